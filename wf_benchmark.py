@@ -0,0 +1,288 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from wf_dataprocessing import compute_class_statistics, impute_class_conditional
+from wf_ml_evaluation import split_and_prepare_data
+from wf_ml_evaluation_experimentation import conduct_feature_experiments
+from wf_ml_prediction import evaluate_models
+from wf_ml_training import build_models, compute_class_weight, fit_and_store_model
+from wf_model_registry import load_model
+from wf_profiling import PROFILER, measure
+
+BENCHMARK_DIR = os.path.join('evaluation', 'benchmarks')
+BASELINE_FILE = os.path.join(BENCHMARK_DIR, 'baseline.json')
+RESULTS_FILE = os.path.join(BENCHMARK_DIR, 'latest.json')
+
+MODEL_NAMES = ['gradient_boosting', 'logistic_regression', 'random_forest', 'knn']
+BENCHMARKS = (['impute', 'split'] + [f'fit:{name}' for name in MODEL_NAMES]
+              + ['evaluate_models', 'feature_experiments'])
+
+
+def generate_secom_like(n_rows, n_features=590, nan_rate=0.045, fail_rate=0.066, seed=0):
+    """
+    Synthetic SECOM-shaped data: heterogeneous feature scales, a block of
+    constant sensors, class-dependent shifts on a few features (including
+    feature_516 and feature_244) and missing values at `nan_rate`.
+
+    Returns (features, classes) with classes in {-1 (pass), 1 (fail)}.
+    """
+    rng = np.random.default_rng(seed)
+    classes = np.where(rng.random(n_rows) < fail_rate, 1, -1)
+
+    scales = 10.0 ** rng.uniform(-2, 3, n_features)
+    centers = rng.normal(0, 1, n_features) * scales
+    features = rng.standard_normal((n_rows, n_features))
+    features *= scales
+    features += centers
+
+    informative = np.unique(np.r_[rng.choice(n_features, 20, replace=False), [516, 244]] % n_features)
+    features[np.ix_(classes == 1, informative)] += 0.5 * scales[informative]
+    features[:, rng.choice(n_features, n_features // 20, replace=False)] = 1.0
+
+    # Mask in row blocks to keep the temporary boolean matrix small
+    for start in range(0, n_rows, 100_000):
+        block = features[start:start + 100_000]
+        block[rng.random(block.shape) < nan_rate] = np.nan
+    return features, classes
+
+
+def _load_dataset(data_path):
+    with np.load(data_path) as data:
+        return data['features'], data['classes']
+
+
+def _imputed_frame(features, classes, seed=0):
+    feature_df = pd.DataFrame(features, columns=[f'feature_{i}' for i in range(features.shape[1])], copy=False)
+    stats = compute_class_statistics(feature_df, classes)
+    impute_class_conditional(feature_df.values, classes, stats, np.random.default_rng(seed))
+    feature_df.insert(0, 'pass', classes)
+    return feature_df
+
+
+def _trained_models(split, model_dir):
+    """
+    Load models fitted by the fit benchmarks, fitting any that are missing.
+    """
+    model_dir.mkdir(parents=True, exist_ok=True)
+    class_weight = compute_class_weight(split['y_train'])
+    models = build_models(split['X_train'], class_weight)
+    for name in MODEL_NAMES:
+        path = model_dir / f"{name}.pkl"
+        if not path.exists():
+            fit_and_store_model(name, models[name], split['X_train'], split['y_train'], path)
+    return {name: load_model(model_dir / f"{name}.pkl") for name in MODEL_NAMES}
+
+
+def _run_benchmark(name, data_path, workdir):
+    """
+    Run one benchmark in the current (fresh) process and return its record.
+    Only the benchmarked call is measured; setup work happens before it.
+    """
+    warnings.filterwarnings('ignore')
+    features, classes = _load_dataset(data_path)
+    n_rows = len(features)
+    model_dir = Path(workdir) / f"models_{n_rows}"
+
+    if name == 'impute':
+        feature_df = pd.DataFrame(features, columns=[f'feature_{i}' for i in range(features.shape[1])], copy=False)
+        with measure(name, 'benchmark') as record:
+            stats = compute_class_statistics(feature_df, classes)
+            impute_class_conditional(feature_df.values, classes, stats, np.random.default_rng(0))
+    else:
+        df = _imputed_frame(features, classes)
+        del features
+        if name == 'split':
+            with measure(name, 'benchmark') as record:
+                split_and_prepare_data(df, target_column='pass', random_state=0)
+        else:
+            split = split_and_prepare_data(df, target_column='pass', random_state=0)
+            del df
+            if name.startswith('fit:'):
+                model_name = name.split(':', 1)[1]
+                model_dir.mkdir(parents=True, exist_ok=True)
+                model = build_models(split['X_train'], compute_class_weight(split['y_train']))[model_name]
+                with measure(name, 'benchmark') as record:
+                    fit_and_store_model(model_name, model, split['X_train'], split['y_train'],
+                                        model_dir / f"{model_name}.pkl")
+            elif name == 'evaluate_models':
+                _trained_models(split, model_dir)
+                with measure(name, 'benchmark') as record:
+                    evaluate_models(split['X_test'], split['y_test'], base_path=str(model_dir), render=False)
+            elif name == 'feature_experiments':
+                model = _trained_models(split, model_dir)['gradient_boosting']
+                with measure(name, 'benchmark') as record:
+                    conduct_feature_experiments(model, split['X_test'], split['scaler'],
+                                                output_dir=str(Path(workdir) / 'experiments'))
+            else:
+                raise ValueError(f"Unknown benchmark '{name}'")
+
+    return {
+        'benchmark': name,
+        'rows': n_rows,
+        'wall_seconds': record['wall_seconds'],
+        'peak_rss_growth_mb': record['peak_rss_growth_mb']
+    }
+
+
+def summarize_runs(runs):
+    """
+    Combine repeated runs of one benchmark into a single record. Wall time
+    and peak-RSS growth are the medians over the runs, so a single slow or
+    noisy run does not move the result; the fastest run is kept as well.
+    """
+    wall = np.array([run['wall_seconds'] for run in runs])
+    median_wall = float(np.median(wall))
+    # Peak RSS is None where the platform cannot report it
+    growth = [run['peak_rss_growth_mb'] for run in runs]
+    return {
+        'benchmark': runs[0]['benchmark'],
+        'rows': runs[0]['rows'],
+        'repeats': len(runs),
+        'wall_seconds': median_wall,
+        'wall_seconds_min': float(wall.min()),
+        'rows_per_second': runs[0]['rows'] / median_wall if median_wall > 0 else None,
+        'peak_rss_growth_mb': float(np.median(growth)) if None not in growth else None
+    }
+
+
+def run_benchmarks(sizes=(1567,), benchmarks=BENCHMARKS, nan_rate=0.045, fail_rate=0.066, seed=0,
+                   workdir=None, repeat=3, warmup=1):
+    """
+    Run every benchmark at every dataset size.
+
+    Each run of a benchmark happens in its own fresh process so its peak-RSS
+    growth is not masked by earlier work. Every benchmark is run `warmup`
+    times unmeasured (warming the page cache and the imported code paths)
+    and then `repeat` times; see summarize_runs. Datasets are generated once
+    per size and handed to the workers as .npz files.
+    """
+    unknown = [name for name in benchmarks if name not in BENCHMARKS]
+    if unknown:
+        raise ValueError(f"Unknown benchmark(s): {', '.join(unknown)}. Available: {', '.join(BENCHMARKS)}")
+
+    results = []
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        for n_rows in sizes:
+            features, classes = generate_secom_like(n_rows, nan_rate=nan_rate, fail_rate=fail_rate, seed=seed)
+            data_path = os.path.join(tmp, f"secom_{n_rows}.npz")
+            np.savez(data_path, features=features, classes=classes)
+            del features, classes
+
+            for name in benchmarks:
+                print(f"Benchmarking {name} on {n_rows} rows ({warmup} warmup, {repeat} measured run(s))...")
+                runs = []
+                try:
+                    for run in range(warmup + repeat):
+                        with ProcessPoolExecutor(max_workers=1) as executor:
+                            record = executor.submit(_run_benchmark, name, data_path, tmp).result()
+                        if run >= warmup:
+                            runs.append(record)
+                except Exception as e:
+                    print(f"Error benchmarking {name}: {str(e)}")
+                    continue
+                result = summarize_runs(runs)
+                throughput = (f"{result['rows_per_second']:,.0f} rows/s" if result['rows_per_second'] is not None
+                              else "n/a rows/s")
+                memory = (f"+{result['peak_rss_growth_mb']:.1f} MB peak RSS"
+                          if result['peak_rss_growth_mb'] is not None else "peak RSS n/a")
+                print(f"  median {result['wall_seconds']:.3f}s (min {result['wall_seconds_min']:.3f}s), "
+                      f"{throughput}, {memory}")
+                results.append(result)
+    return results
+
+
+def _key(result):
+    return f"{result['benchmark']}@{result['rows']}"
+
+
+def compare_to_baseline(results, baseline, threshold=0.2):
+    """
+    Flag results whose throughput dropped, or whose peak memory growth rose,
+    by more than `threshold` relative to the baseline.
+    """
+    regressions = []
+    for result in results:
+        base = baseline.get(_key(result))
+        if base is None:
+            continue
+        if base['rows_per_second'] and result['rows_per_second'] is not None \
+                and result['rows_per_second'] < base['rows_per_second'] * (1 - threshold):
+            regressions.append(f"{_key(result)}: throughput {result['rows_per_second']:,.0f} rows/s "
+                               f"vs baseline {base['rows_per_second']:,.0f} rows/s")
+        # Ignore growth below 1 MB, which is within measurement noise
+        if result['peak_rss_growth_mb'] is None or base['peak_rss_growth_mb'] is None:
+            continue
+        if result['peak_rss_growth_mb'] > max(base['peak_rss_growth_mb'] * (1 + threshold),
+                                              base['peak_rss_growth_mb'] + 1):
+            regressions.append(f"{_key(result)}: peak RSS growth {result['peak_rss_growth_mb']:.1f} MB "
+                               f"vs baseline {base['peak_rss_growth_mb']:.1f} MB")
+    return regressions
+
+
+def load_baseline(path=BASELINE_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_results(results, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({_key(result): result for result in results}, f, indent=2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the SECOM pipeline hot paths on synthetic data.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1567],
+                        help='dataset sizes to benchmark (default: 1567, the size of SECOM)')
+    parser.add_argument('--benchmarks', nargs='+', default=BENCHMARKS, metavar='NAME',
+                        help=f"benchmarks to run (default: all of {', '.join(BENCHMARKS)})")
+    parser.add_argument('--nan-rate', type=float, default=0.045, help='fraction of missing feature values')
+    parser.add_argument('--fail-rate', type=float, default=0.066, help='fraction of failed wafers')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='measured runs per benchmark; the median is reported and compared (default: 3)')
+    parser.add_argument('--warmup', type=int, default=1, help='unmeasured runs before the measured ones')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='relative throughput/memory change reported as a regression')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store these results as the new baseline instead of comparing')
+    args = parser.parse_args(argv)
+
+    PROFILER.configure(enabled=True)
+    if args.repeat < 1:
+        parser.error('--repeat must be at least 1')
+    results = run_benchmarks(args.rows, args.benchmarks, args.nan_rate, args.fail_rate, args.seed,
+                             repeat=args.repeat, warmup=args.warmup)
+    save_results(results, RESULTS_FILE)
+
+    if args.save_baseline:
+        baseline = load_baseline(args.baseline)
+        baseline.update({_key(result): result for result in results})
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    regressions = compare_to_baseline(results, load_baseline(args.baseline), args.threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if not regressions:
+        print("No regressions against baseline")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
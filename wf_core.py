@@ -1,13 +1,58 @@
+import argparse
+import os
 import warnings
 
-from wf_dataprocessing import mung_data
-from wf_ml_evaluation import evaluate_data
-from wf_visualization import visualize_data
+from wf_ml_training import KNN_BACKENDS
+from wf_pipeline import STAGES, configure_stages, plan, run
+from wf_profiling import PROFILER
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Run the SECOM yield analysis pipeline, re-executing only stages whose inputs changed.'
+    )
+    parser.add_argument('stages', nargs='*', metavar='STAGE',
+                        help=f"stages to run with their upstream stages "
+                             f"({', '.join(stage.name for stage in STAGES)}); default: all")
+    parser.add_argument('--dry-run', action='store_true', help='print the execution plan without running it')
+    parser.add_argument('--force', action='store_true',
+                        help='run the named stages (default: all) even if up to date; '
+                             'their upstream stages still only run when stale')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='maximum number of stages to run concurrently (default: all independent stages)')
+    parser.add_argument('--report', default=os.path.join('evaluation', 'run_report.json'),
+                        help='timing/memory run report to write (.json or .csv)')
+    parser.add_argument('--profile', action='store_true',
+                        help='also capture cProfile output for every stage under evaluation/profiles')
+    parser.add_argument('--float32', action='store_true',
+                        help='store and process the features in single precision (halves memory and I/O)')
+    parser.add_argument('--no-render', action='store_true',
+                        help='skip rendering the visualization, evaluation and experiment plots')
+    parser.add_argument('--knn-backend', choices=KNN_BACKENDS, default='sklearn',
+                        help="KNN implementation; 'blocked' and 'pca' bound prediction memory (default: sklearn)")
+    return parser.parse_args(argv)
+
 
 if __name__ == '__main__':
     warnings.filterwarnings('ignore', category=RuntimeWarning)
     warnings.filterwarnings('ignore', category=UserWarning)
 
-    mung_data()
-    visualize_data()
-    evaluate_data(True)
+    args = parse_args()
+    # Downstream stages follow the dtype of the store written by mung
+    params = {'mung': {'dtype': 'float32'}} if args.float32 else {}
+    params['evaluate'] = {'knn_backend': args.knn_backend}
+    if args.no_render:
+        params['visualize'] = {'render': False}
+        params['evaluate']['render'] = False
+    stages = configure_stages(params)
+    if args.dry_run:
+        for name, reason in plan(args.stages, force=args.force, stages=stages):
+            print(f"{name}: {'run (' + reason + ')' if reason else 'up to date'}")
+    else:
+        PROFILER.configure(cprofile_categories=['stage'] if args.profile else [])
+        outcome = run(args.stages, force=args.force, max_workers=args.jobs, stages=stages)
+        # Keep the last report when nothing ran instead of replacing it with an empty one
+        if any(status != 'up to date' for status in outcome.values()):
+            print(f"Run report written to {PROFILER.write_report(args.report)}")
+        else:
+            print(f"Nothing ran; run report {args.report} left unchanged")
@@ -1,81 +1,423 @@
 import os
-import pickle
 
 import numpy as np
 import pandas as pd
 
+from wf_profiling import measure
+from wf_storage import (FEATURE_DTYPES, IMPUTATION_STATS, SECOM_OUTPUT, TIME_COLUMN, ColumnarWriter, audit_dtype,
+                        write_columnar)
+
 __author__ = 'Fischbach'
 __date__ = '10/22/24'
 __assignment = 'MS 3: Data Munging and Visualization'
 
+# Fixed seed of the imputation noise, so re-munging unchanged raw data
+# writes the same store and cached models stay valid
+IMPUTATION_SEED = 0
+
+
+def compute_class_statistics(features_df, classes):
+    """
+    Compute per-class medians, standard deviations and non-missing counts for
+    every feature column in a single grouped pass.
+    """
+    grouped = features_df.groupby(np.asarray(classes), sort=True)
+    medians = grouped.median()
+    stds = grouped.std()
+    return {
+        'classes': medians.index.to_numpy(),
+        'rows': grouped.size().to_numpy(),
+        'count': grouped.count().to_numpy(),
+        'median': medians.to_numpy(),
+        'std': stds.to_numpy()
+    }
+
+
+def save_imputation_stats(stats, path=IMPUTATION_STATS):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.savez(path, **stats)
+
+
+def load_imputation_stats(path=IMPUTATION_STATS):
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+
+def unconditional_fill_values(stats):
+    """
+    Per-feature fill values for rows whose class is unknown (e.g. at scoring
+    time): the class medians weighted by class size.
+    """
+    weights = np.where(np.isnan(stats['median']), 0.0, stats['rows'][:, np.newaxis])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.nansum(stats['median'] * weights, axis=0) / weights.sum(axis=0)
+
+
+def missing_fraction(stats):
+    """
+    Per-feature fraction of missing values before imputation, or None for
+    statistics saved without non-missing counts.
+    """
+    if 'count' not in stats:
+        return None
+    return 1 - stats['count'].sum(axis=0) / stats['rows'].sum()
+
+
+def impute_class_conditional(values, classes, stats, rng):
+    """
+    Fill NaN entries of `values` in place with draws from a normal distribution
+    centred on the class median with the class standard deviation.
+
+    All fills are drawn from `rng` in one batched call and scattered back
+    through the NaN mask. Entries whose class median or std is undefined are
+    left as NaN.
+    """
+    nan_rows, nan_cols = np.nonzero(np.isnan(values))
+    if len(nan_rows) == 0:
+        return values
+
+    class_index = np.searchsorted(stats['classes'], np.asarray(classes))[nan_rows]
+    loc = stats['median'][class_index, nan_cols]
+    scale = stats['std'][class_index, nan_cols]
+
+    values[nan_rows, nan_cols] = loc + scale * rng.standard_normal(len(nan_rows))
+    return values
+
+
+def nan_moments(rows):
+    """
+    Per-column non-missing count, mean and sum of squared deviations (M2)
+    of a 2D array, ignoring NaNs.
+    """
+    count = (~np.isnan(rows)).sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(count > 0, np.nansum(rows, axis=0) / count, 0.0)
+    m2 = np.nansum((rows - mean) ** 2, axis=0)
+    return {'count': count, 'mean': mean, 'm2': m2}
+
+
+def merge_moments(state, moments):
+    """
+    Merge `moments` into the running moments `state` in place (Chan et al.).
+    """
+    total = state['count'] + moments['count']
+    delta = moments['mean'] - state['mean']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ratio = np.where(total > 0, moments['count'] / total, 0.0)
+    state['m2'] += moments['m2'] + delta ** 2 * state['count'] * ratio
+    state['mean'] += delta * ratio
+    state['count'] = total
+
+
+def remove_moments(state, moments):
+    """
+    Remove previously merged `moments` from the running moments `state` in
+    place; the inverse of merge_moments.
+    """
+    remaining = state['count'] - moments['count']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(remaining > 0,
+                        (state['count'] * state['mean'] - moments['count'] * moments['mean']) / remaining,
+                        0.0)
+        delta = moments['mean'] - mean
+        m2 = state['m2'] - moments['m2'] - np.where(
+            remaining > 0, delta ** 2 * remaining * moments['count'] / state['count'], 0.0)
+    state['mean'] = mean
+    # Cancellation can leave tiny negative residues
+    state['m2'] = np.where(remaining > 0, np.maximum(m2, 0.0), 0.0)
+    state['count'] = remaining
+
+
+class StreamingClassStatistics:
+    """
+    Accumulate per-class imputation statistics over row chunks.
+
+    Standard deviations are exact (chunk moments are merged pairwise).
+    Medians are taken from a bounded per-class reservoir sample, which is
+    exact whenever a class has no more rows than `sample_size`.
+    """
+
+    def __init__(self, n_features, sample_size=10000, seed=None):
+        self.n_features = n_features
+        self.sample_size = sample_size
+        self.rng = np.random.default_rng(seed)
+        self.n_rows = 0
+        self._classes = {}
+
+    def update(self, values, classes):
+        self.n_rows += len(values)
+        for value in np.unique(classes):
+            self._update_class(value, values[classes == value])
+
+    def _update_class(self, value, rows):
+        state = self._classes.get(value)
+        if state is None:
+            state = {
+                'seen': 0,
+                'count': np.zeros(self.n_features),
+                'mean': np.zeros(self.n_features),
+                'm2': np.zeros(self.n_features),
+                'sample': np.full((self.sample_size, self.n_features), np.nan)
+            }
+            self._classes[value] = state
+
+        # Merge chunk moments into the running moments (Chan et al.)
+        merge_moments(state, nan_moments(rows))
+
+        # Reservoir sampling (Algorithm R) of whole rows for the median
+        positions = state['seen'] + np.arange(len(rows))
+        slots = np.where(
+            positions < self.sample_size,
+            positions,
+            self.rng.integers(0, positions + 1)
+        )
+        keep = slots < self.sample_size
+        state['sample'][slots[keep]] = rows[keep]
+        state['seen'] += len(rows)
 
-def mung_data():
-    def simulate_nan_values(df):
-        result_df = df.copy()
-        feature_cols = [col for col in df.columns if col.startswith('feature_')]
+    def finalize(self):
+        classes = np.array(sorted(self._classes))
+        rows = []
+        counts = []
+        medians = []
+        stds = []
+        for value in classes:
+            state = self._classes[value]
+            sample = state['sample'][:min(state['seen'], self.sample_size)]
+            rows.append(state['seen'])
+            counts.append(state['count'])
+            with np.errstate(invalid='ignore', divide='ignore'):
+                medians.append(np.nanmedian(sample, axis=0) if len(sample) else
+                               np.full(self.n_features, np.nan))
+                stds.append(np.where(state['count'] > 1,
+                                     np.sqrt(state['m2'] / (state['count'] - 1)),
+                                     np.nan))
+        return {
+            'classes': classes,
+            'rows': np.array(rows),
+            'count': np.vstack(counts),
+            'median': np.vstack(medians),
+            'std': np.vstack(stds)
+        }
 
-        for value in df['pass'].unique():
-            mask = df['pass'] == value
-            class_df = df[mask]
 
-            for col in feature_cols:
-                if df[col].isna().any():
-                    median_val = class_df[col].median()
-                    std_val = class_df[col].std()
+class WindowClassStatistics:
+    """
+    Per-class imputation statistics over a sliding window of rows.
 
-                    nan_count = df.loc[mask, col].isna().sum()
-                    if nan_count > 0 and not pd.isna(median_val) and not pd.isna(std_val):
-                        rng = np.random.default_rng()
-                        random_values = rng.normal(
-                            loc=median_val,
-                            scale=std_val,
-                            size=nan_count
-                        )
-                        result_df.loc[mask & df[col].isna(), col] = random_values
+    Rows can be added as the window advances and removed as they fall out of
+    it, so each window costs work proportional to the rows that changed
+    rather than the window size. Standard deviations are exact (moments are
+    merged and un-merged). Medians come from fixed-width per-feature
+    histograms between `lower` and `upper` (values outside are clipped into
+    the end bins), so they are within one bin width of the middle
+    observations.
 
-        return result_df
+    The pooled moments over all classes give the scaler statistics.
+    """
+
+    def __init__(self, lower, upper, n_bins=256):
+        self.lower = np.asarray(lower, dtype=np.float64)
+        self.upper = np.asarray(upper, dtype=np.float64)
+        self.n_features = len(self.lower)
+        self.n_bins = n_bins
+        width = (self.upper - self.lower) / n_bins
+        self._constant = ~(width > 0)
+        self._width = np.where(self._constant, 1.0, width)
+        self._classes = {}
+
+    def _state(self, value):
+        state = self._classes.get(value)
+        if state is None:
+            state = {
+                'rows': 0,
+                'count': np.zeros(self.n_features),
+                'mean': np.zeros(self.n_features),
+                'm2': np.zeros(self.n_features),
+                'hist': np.zeros((self.n_features, self.n_bins), dtype=np.int64)
+            }
+            self._classes[value] = state
+        return state
+
+    def _histogram(self, rows):
+        rows_idx, cols = np.nonzero(~np.isnan(rows))
+        bins = np.floor((rows[rows_idx, cols] - self.lower[cols]) / self._width[cols])
+        bins = np.clip(bins, 0, self.n_bins - 1).astype(np.intp)
+        counts = np.bincount(cols * self.n_bins + bins, minlength=self.n_features * self.n_bins)
+        return counts.reshape(self.n_features, self.n_bins)
+
+    def add(self, values, classes):
+        for value in np.unique(classes):
+            rows = values[classes == value]
+            state = self._state(value)
+            state['rows'] += len(rows)
+            merge_moments(state, nan_moments(rows))
+            state['hist'] += self._histogram(rows)
+
+    def remove(self, values, classes):
+        for value in np.unique(classes):
+            rows = values[classes == value]
+            state = self._classes[value]
+            state['rows'] -= len(rows)
+            remove_moments(state, nan_moments(rows))
+            state['hist'] -= self._histogram(rows)
+
+    def _median(self, state):
+        cumulative = np.cumsum(state['hist'], axis=1)
+        half = state['count'] / 2
+        bins = np.argmax(cumulative >= half[:, np.newaxis], axis=1)
+        in_bin = state['hist'][np.arange(self.n_features), bins]
+        before = cumulative[np.arange(self.n_features), bins] - in_bin
+        with np.errstate(invalid='ignore', divide='ignore'):
+            median = self.lower + self._width * (bins + (half - before) / in_bin)
+        median = np.where(self._constant, self.lower, median)
+        return np.where(state['count'] > 0, median, np.nan)
+
+    def statistics(self):
+        """
+        Statistics of the current window in the compute_class_statistics format.
+        """
+        classes = np.array(sorted(value for value, state in self._classes.items() if state['rows'] > 0))
+        states = [self._classes[value] for value in classes]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            stds = [np.where(state['count'] > 1, np.sqrt(state['m2'] / (state['count'] - 1)), np.nan)
+                    for state in states]
+        return {
+            'classes': classes,
+            'rows': np.array([state['rows'] for state in states]),
+            'count': np.vstack([state['count'] for state in states]),
+            'median': np.vstack([self._median(state) for state in states]),
+            'std': np.vstack(stds)
+        }
+
+    def pooled_moments(self):
+        """
+        Non-missing count, mean and M2 of the window over all classes.
+        """
+        pooled = {'count': np.zeros(self.n_features), 'mean': np.zeros(self.n_features),
+                  'm2': np.zeros(self.n_features)}
+        for state in self._classes.values():
+            merge_moments(pooled, state)
+        return pooled
+
+
+def read_labels(path, chunksize=None):
+    return pd.read_csv(path,
+                       sep=' ',
+                       header=None,
+                       names=['pass', 'timestamp'],
+                       quotechar='"',
+                       date_format='%d/%m/%Y %H:%M:%S',
+                       parse_dates=[1],
+                       chunksize=chunksize)
+
+
+def read_features(path, chunksize=None, dtype=np.float64):
+    return pd.read_csv(path,
+                       sep=' ',
+                       header=None,
+                       names=[f'feature_{i}' for i in range(590)],
+                       na_values='NaN',
+                       dtype=dtype,
+                       index_col=False,
+                       chunksize=chunksize)
+
+
+def iter_aligned_chunks(labels, features, chunksize, dtype=np.float64):
+    """
+    Yield (labels_chunk, features_chunk) pairs read in lockstep from the
+    labels and features files.
+    """
+    with read_labels(labels, chunksize) as label_reader, \
+            read_features(features, chunksize, dtype) as feature_reader:
+        for labels_chunk, features_chunk in zip(label_reader, feature_reader, strict=True):
+            if len(labels_chunk) != len(features_chunk):
+                raise ValueError(
+                    f"Labels and features are misaligned: chunk of {len(labels_chunk)} "
+                    f"labels vs {len(features_chunk)} feature rows"
+                )
+            yield labels_chunk, features_chunk
+
+
+def mung_data_streaming(labels, features, output, chunksize, seed=None, dtype=np.float64):
+    """
+    Two-pass, chunked variant of mung_data.
+
+    The first pass gathers per-class imputation statistics; the second pass
+    imputes each chunk and writes it straight into the columnar store, so
+    memory use is bounded by the chunk size rather than the file.
+    """
+    seed_seq = np.random.SeedSequence(seed)
+    stats_seed, impute_seed = seed_seq.spawn(2)
+
+    with measure('mung:statistics_pass', 'mung'):
+        accumulator = StreamingClassStatistics(590, seed=stats_seed)
+        for labels_chunk, features_chunk in iter_aligned_chunks(labels, features, chunksize, dtype):
+            accumulator.update(features_chunk.to_numpy(), labels_chunk['pass'].to_numpy())
+        stats = accumulator.finalize()
+        save_imputation_stats(stats)
+
+    dtypes = {'pass': np.int64, TIME_COLUMN: 'datetime64[ns]'}
+    dtypes.update({f'feature_{i}': dtype for i in range(590)})
+
+    rng = np.random.default_rng(impute_seed)
+    with measure('mung:impute_pass', 'mung'), ColumnarWriter(output, dtypes, accumulator.n_rows) as writer:
+        for labels_chunk, features_chunk in iter_aligned_chunks(labels, features, chunksize, dtype):
+            classes = labels_chunk['pass'].to_numpy()
+            impute_class_conditional(features_chunk.values, classes, stats, rng)
+            audit_dtype(features_chunk, dtype, 'mung:impute_pass')
+            features_chunk.insert(0, 'pass', classes)
+            features_chunk.insert(1, TIME_COLUMN, labels_chunk[TIME_COLUMN].to_numpy())
+            writer.write(features_chunk)
+
+    return output
+
+
+def mung_data(seed=IMPUTATION_SEED, chunksize=None, dtype='float64'):
+    """
+    Read the raw SECOM files, impute missing feature values per class and
+    serialize the result. The imputation draws from `seed` (IMPUTATION_SEED
+    by default); pass None for fresh noise every run.
+
+    When `chunksize` is given the files are streamed in aligned row chunks
+    and the output is written incrementally (see mung_data_streaming).
+    `dtype='float32'` reads, imputes and stores the features in single
+    precision, halving the size of the store and of every stage reading it.
+    """
+    if np.dtype(dtype).name not in FEATURE_DTYPES:
+        raise ValueError(f"Unsupported feature dtype '{dtype}'. Available: {', '.join(FEATURE_DTYPES)}")
+    dtype = np.dtype(dtype)
 
     path_sep = os.path.sep
     labels = 'data_original' + path_sep + 'secom_labels.data'
     features = 'data_original' + path_sep + 'secom.data'
-    output = (
-            'data_processed'
-            + path_sep
-            + 'serialized'
-            + path_sep
-            + 'secom_output.pickle'
-    )
-
-    labels_df = pd.read_csv(labels,
-                            sep=' ',
-                            header=None,
-                            names=['pass', 'timestamp'],
-                            quotechar='"',
-                            date_format='%d/%m/%Y %H:%M:%S',
-                            parse_dates=[1])
-
-    features_df = pd.read_csv(features,
-                              sep=' ',
-                              header=None,
-                              names=[f'feature_{i}' for i in range(590)],
-                              na_values='NaN',
-                              dtype=np.float64,
-                              index_col=False)
-
-    labels_df = labels_df.reset_index(drop=True)
-    features_df = features_df.reset_index(drop=True)
-
-    combined_df = pd.concat([labels_df['pass'], features_df], axis=1, ignore_index=False)
-
-    final_df = simulate_nan_values(combined_df)
-
-    os.makedirs(os.path.dirname(output), exist_ok=True)
-    with open(output, 'wb') as output_file:
-        try:
-            pickle.dump(final_df, output_file)
-        except Exception as err:
-            print(err)
-            pass
+    output = SECOM_OUTPUT
+
+    if chunksize is not None:
+        return mung_data_streaming(labels, features, output, chunksize, seed, dtype)
+
+    with measure('mung:read', 'mung'):
+        labels_df = read_labels(labels)
+        features_df = read_features(features, dtype=dtype)
+
+    classes = labels_df['pass'].to_numpy()
+
+    # Impute directly on the homogeneous feature block, then attach the label
+    # and timestamp columns without concatenating (and copying) the whole frame.
+    with measure('mung:impute', 'mung'):
+        stats = compute_class_statistics(features_df, classes)
+        save_imputation_stats(stats)
+        impute_class_conditional(features_df.values, classes, stats, np.random.default_rng(seed))
+        features_df.insert(0, 'pass', classes)
+        features_df.insert(1, TIME_COLUMN, labels_df[TIME_COLUMN].to_numpy())
+        final_df = audit_dtype(features_df, dtype, 'mung:impute')
+
+    try:
+        with measure('mung:write', 'mung'):
+            write_columnar(final_df, output)
+    except Exception as err:
+        print(err)
+        raise
 
 
 if __name__ == '__main__':
@@ -0,0 +1,148 @@
+import json
+import os
+
+import numpy as np
+
+from wf_dataprocessing import load_imputation_stats, missing_fraction
+from wf_profiling import measure
+from wf_storage import FEATURE_MANIFEST, IMPUTATION_STATS, load_secom, read_schema
+
+
+def _column_moments(values):
+    # Accumulate in float64 whatever the stored precision
+    mean = values.mean(axis=0, dtype=np.float64)
+    std = values.std(axis=0, ddof=1, dtype=np.float64) if len(values) > 1 else np.zeros(values.shape[1])
+    return mean, std
+
+
+def correlated_columns(values, threshold=0.98, block_size=256):
+    """
+    Greedily pick columns to drop so that no two remaining columns have an
+    absolute Pearson correlation above `threshold`; of each such pair the
+    later column is dropped.
+
+    The correlation matrix is computed one (block x block) tile at a time
+    from standardized column blocks, so memory is bounded by the block size
+    rather than the number of columns. Columns must have non-zero variance.
+
+    Returns the set of dropped column positions.
+    """
+    n_rows, n_cols = values.shape
+    mean, std = _column_moments(values)
+
+    def standardized(start, stop):
+        return (values[:, start:stop] - mean[start:stop]) / std[start:stop]
+
+    dropped = set()
+    for i_start in range(0, n_cols, block_size):
+        i_stop = min(i_start + block_size, n_cols)
+        z_i = standardized(i_start, i_stop)
+
+        for j_start in range(i_start, n_cols, block_size):
+            j_stop = min(j_start + block_size, n_cols)
+            z_j = z_i if j_start == i_start else standardized(j_start, j_stop)
+            tile = np.abs(z_i.T @ z_j) / (n_rows - 1)
+
+            # Earlier blocks have already been resolved, so walking this
+            # block's columns in order reproduces the column-by-column greedy
+            for i in range(i_start, i_stop):
+                if i in dropped:
+                    continue
+                row = tile[i - i_start]
+                for j in np.flatnonzero(row > threshold) + j_start:
+                    if j > i:
+                        dropped.add(int(j))
+    return dropped
+
+
+def select_features(df, nan_fraction=None, variance_threshold=0.0, nan_threshold=0.5,
+                    correlation_threshold=0.98, block_size=256, target_column='pass'):
+    """
+    Decide which feature columns to keep.
+
+    Parameters:
+    df: DataFrame of imputed features (and optionally the target column)
+    nan_fraction: per-feature fraction of values missing before imputation
+    variance_threshold: columns with variance at or below this are dropped
+    nan_threshold: columns missing more than this fraction are dropped
+    correlation_threshold: of each column pair correlated above this, the
+                           later column is dropped
+    block_size: columns per tile in the blocked correlation computation
+
+    Returns:
+    manifest dict with 'kept' column names and 'dropped' {column: reason}
+    """
+    features = [col for col in df.columns if col != target_column]
+    dropped = {}
+
+    if nan_fraction is not None:
+        for col, fraction in zip(features, nan_fraction):
+            if fraction > nan_threshold:
+                dropped[col] = f'missing fraction {fraction:.3f}'
+
+    candidates = [col for col in features if col not in dropped]
+    values = df[candidates].to_numpy()
+    variances = values.var(axis=0, ddof=1, dtype=np.float64) if len(values) > 1 else np.zeros(len(candidates))
+    low_variance = ~(variances > variance_threshold)
+    for col, low, variance in zip(candidates, low_variance, variances):
+        if low:
+            dropped[col] = f'variance {variance:.3g}'
+
+    candidates = [col for col, low in zip(candidates, low_variance) if not low]
+    values = values[:, ~low_variance]
+    for position in sorted(correlated_columns(values, correlation_threshold, block_size)):
+        dropped[candidates[position]] = f'correlation above {correlation_threshold}'
+
+    return {
+        'kept': [col for col in features if col not in dropped],
+        'dropped': dropped,
+        'thresholds': {
+            'variance': variance_threshold,
+            'missing_fraction': nan_threshold,
+            'correlation': correlation_threshold
+        }
+    }
+
+
+def save_feature_manifest(manifest, path=FEATURE_MANIFEST):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+
+def load_feature_manifest(path=FEATURE_MANIFEST):
+    """
+    Return the persisted feature manifest, or None if there is none.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def apply_feature_selection(df, manifest, target_column='pass'):
+    """
+    Project a frame onto the kept feature columns (plus the target if present).
+    """
+    columns = ([target_column] if target_column in df.columns else []) + manifest['kept']
+    return df[columns]
+
+
+def select_data(**thresholds):
+    """
+    Feature pruning stage: fit the manifest on the munged data and persist it.
+    """
+    features = [column['name'] for column in read_schema()['columns'] if column['name'].startswith('feature_')]
+    with measure('select:load', 'io'):
+        data_f = load_secom(features)
+
+    nan_fraction = None
+    if os.path.exists(IMPUTATION_STATS):
+        nan_fraction = missing_fraction(load_imputation_stats())
+
+    with measure('select:fit', 'select'):
+        manifest = select_features(data_f, nan_fraction=nan_fraction, **thresholds)
+    save_feature_manifest(manifest)
+
+    print(f"Feature selection kept {len(manifest['kept'])} of {len(features)} features")
+    return manifest
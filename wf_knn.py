@@ -0,0 +1,118 @@
+import numpy as np
+from scipy.spatial.distance import cdist
+from sklearn.base import BaseEstimator, ClassifierMixin
+from sklearn.decomposition import PCA
+
+# scipy names for the metrics accepted by the estimator
+METRICS = {'manhattan': 'cityblock', 'cityblock': 'cityblock', 'euclidean': 'euclidean'}
+
+
+def blocked_kneighbors(index, queries, n_neighbors, metric='cityblock', block_size=2048):
+    """
+    Exact k nearest neighbours by brute force over (query block x index block)
+    tiles, keeping a running top-k per query. Memory is bounded by
+    block_size * (block_size + n_neighbors) distances regardless of how many
+    wafers the index holds.
+
+    Returns (distances, indices), each of shape (n_queries, n_neighbors),
+    sorted by increasing distance.
+    """
+    n_queries = len(queries)
+    distances = np.empty((n_queries, n_neighbors))
+    indices = np.empty((n_queries, n_neighbors), dtype=np.intp)
+
+    for q_start in range(0, n_queries, block_size):
+        query = queries[q_start:q_start + block_size]
+        best_dist = np.full((len(query), 0), np.inf)
+        best_idx = np.empty((len(query), 0), dtype=np.intp)
+
+        for i_start in range(0, len(index), block_size):
+            block = index[i_start:i_start + block_size]
+            cand_dist = np.hstack([best_dist, cdist(query, block, metric=metric)])
+            cand_idx = np.hstack([best_idx, np.broadcast_to(np.arange(i_start, i_start + len(block)),
+                                                           (len(query), len(block)))])
+            if cand_dist.shape[1] > n_neighbors:
+                keep = np.argpartition(cand_dist, n_neighbors - 1, axis=1)[:, :n_neighbors]
+                cand_dist = np.take_along_axis(cand_dist, keep, axis=1)
+                cand_idx = np.take_along_axis(cand_idx, keep, axis=1)
+            best_dist, best_idx = cand_dist, cand_idx
+
+        order = np.argsort(best_dist, axis=1, kind='stable')
+        distances[q_start:q_start + len(query)] = np.take_along_axis(best_dist, order, axis=1)
+        indices[q_start:q_start + len(query)] = np.take_along_axis(best_idx, order, axis=1)
+    return distances, indices
+
+
+class BlockedKNeighborsClassifier(ClassifierMixin, BaseEstimator):
+    """
+    K-nearest-neighbours classifier over a compact float32 index.
+
+    Neighbours are found with a blocked brute-force kernel (see
+    blocked_kneighbors) instead of a tree index, which degrades to brute force
+    at SECOM's width anyway but with unbounded temporaries. With
+    `n_components` set, wafers are first projected onto that many principal
+    components, trading exactness for a smaller index and cheaper distances.
+
+    Prediction follows KNeighborsClassifier: `weights='distance'` weighs each
+    neighbour by 1 / distance, and exact matches take all the weight.
+    """
+
+    def __init__(self, n_neighbors=5, weights='distance', metric='manhattan', n_components=None,
+                 block_size=2048):
+        self.n_neighbors = n_neighbors
+        self.weights = weights
+        self.metric = metric
+        self.n_components = n_components
+        self.block_size = block_size
+
+    def _project(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        if self.projection_ is not None:
+            X = self.projection_.transform(X).astype(np.float32, copy=False)
+        return X
+
+    def fit(self, X, y):
+        if self.weights not in ('uniform', 'distance'):
+            raise ValueError(f"weights must be 'uniform' or 'distance', got {self.weights!r}")
+        if self.metric not in METRICS:
+            raise ValueError(f"Unsupported metric {self.metric!r}. Available: {', '.join(METRICS)}")
+
+        if hasattr(X, 'columns'):
+            self.feature_names_in_ = np.asarray(X.columns, dtype=object)
+        X = np.asarray(X, dtype=np.float32)
+        self.n_features_in_ = X.shape[1]
+
+        self.projection_ = None
+        if self.n_components is not None and self.n_components < X.shape[1]:
+            self.projection_ = PCA(n_components=self.n_components, svd_solver='randomized',
+                                   random_state=0).fit(X)
+
+        self.classes_, self._y = np.unique(np.asarray(y), return_inverse=True)
+        self._fit_X = np.ascontiguousarray(self._project(X))
+        return self
+
+    def kneighbors(self, X, n_neighbors=None):
+        n_neighbors = min(n_neighbors or self.n_neighbors, len(self._fit_X))
+        return blocked_kneighbors(self._fit_X, self._project(X), n_neighbors,
+                                  METRICS[self.metric], self.block_size)
+
+    def predict_proba(self, X):
+        distances, indices = self.kneighbors(X)
+        if self.weights == 'uniform':
+            weights = np.ones_like(distances)
+        else:
+            with np.errstate(divide='ignore'):
+                weights = 1.0 / distances
+            exact = np.isinf(weights)
+            exact_rows = exact.any(axis=1)
+            weights[exact_rows] = exact[exact_rows]
+
+        labels = self._y[indices]
+        proba = np.zeros((len(distances), len(self.classes_)))
+        for k, _ in enumerate(self.classes_):
+            proba[:, k] = np.sum(weights * (labels == k), axis=1)
+        proba /= proba.sum(axis=1, keepdims=True)
+        return proba
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
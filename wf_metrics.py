@@ -0,0 +1,185 @@
+import numpy as np
+
+METRICS = ['balanced_accuracy', 'accuracy', 'precision', 'recall', 'f1']
+
+
+def encode_labels(y_true, y_pred, labels=None):
+    """
+    Map labels to codes 0..k-1 once for the true labels and a stack of
+    predictions (one row per model).
+
+    Returns (true codes, prediction codes of shape (n_models, n), labels).
+    """
+    y_true = np.asarray(y_true)
+    y_pred = np.atleast_2d(np.asarray(y_pred))
+    if y_pred.shape[1] != len(y_true):
+        raise ValueError(f"Predictions cover {y_pred.shape[1]} samples, expected {len(y_true)}")
+    if labels is None:
+        labels = np.union1d(y_true, y_pred)
+    labels = np.asarray(labels)
+
+    true_codes = np.searchsorted(labels, y_true)
+    pred_codes = np.searchsorted(labels, y_pred)
+    if not (np.array_equal(labels[np.minimum(true_codes, len(labels) - 1)], y_true)
+            and np.array_equal(labels[np.minimum(pred_codes, len(labels) - 1)], y_pred)):
+        raise ValueError(f"Labels outside of {labels.tolist()}")
+    return true_codes, pred_codes, labels
+
+
+def confusion_counts(true_codes, pred_codes, n_labels):
+    """
+    Confusion matrices of every model from a single bincount.
+
+    Returns an array of shape (n_models, n_labels, n_labels) with true labels
+    along the rows, as sklearn's confusion_matrix.
+    """
+    n_models = len(pred_codes)
+    cells = (np.arange(n_models)[:, np.newaxis] * n_labels + true_codes) * n_labels + pred_codes
+    counts = np.bincount(cells.ravel(), minlength=n_models * n_labels * n_labels)
+    return counts.reshape(n_models, n_labels, n_labels)
+
+
+def metrics_from_confusion(confusion, pos_index):
+    """
+    Derive the evaluation metrics from confusion matrices of shape
+    (..., k, k). Precision, recall and F1 are for the label at `pos_index`
+    and are 0 when undefined, like sklearn with zero_division=0. Balanced
+    accuracy averages recall over the labels that occur in the true labels.
+
+    Returns {metric name: array over the leading dimensions}.
+    """
+    confusion = np.asarray(confusion, dtype=np.float64)
+    diagonal = np.diagonal(confusion, axis1=-2, axis2=-1)
+    support = confusion.sum(axis=-1)
+    predicted = confusion.sum(axis=-2)
+    total = support.sum(axis=-1)
+
+    tp = diagonal[..., pos_index]
+    fp = predicted[..., pos_index] - tp
+    fn = support[..., pos_index] - tp
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        class_recall = np.where(support > 0, diagonal / support, 0.0)
+        balanced = class_recall.sum(axis=-1) / (support > 0).sum(axis=-1)
+        return {
+            'balanced_accuracy': balanced,
+            'accuracy': diagonal.sum(axis=-1) / total,
+            'precision': np.where(tp + fp > 0, tp / (tp + fp), 0.0),
+            'recall': np.where(tp + fn > 0, tp / (tp + fn), 0.0),
+            'f1': np.where(2 * tp + fp + fn > 0, 2 * tp / (2 * tp + fp + fn), 0.0)
+        }
+
+
+def bootstrap_confusion(true_codes, pred_codes, n_labels, n_bootstrap=1000, seed=None):
+    """
+    Confusion matrices of `n_bootstrap` row resamples, without rescoring.
+
+    Each row is reduced to its joint outcome (true label and every model's
+    prediction). Resampling rows with replacement is then a multinomial draw
+    over the distinct outcomes, which maps back to confusion counts with one
+    matrix product. All models see the same resamples, so their intervals
+    are paired.
+
+    Returns an array of shape (n_bootstrap, n_models, n_labels, n_labels).
+    """
+    rng = np.random.default_rng(seed)
+    n_models, n_rows = pred_codes.shape
+    outcomes = np.vstack([true_codes, pred_codes])
+    distinct, counts = np.unique(outcomes, axis=1, return_counts=True)
+
+    resampled = rng.multinomial(n_rows, counts / n_rows, size=n_bootstrap)
+
+    # One-hot map from each distinct outcome to its (model, true, predicted) cell
+    cells = (np.arange(n_models)[:, np.newaxis] * n_labels + distinct[0]) * n_labels + distinct[1:]
+    mapping = np.zeros((distinct.shape[1], n_models * n_labels * n_labels))
+    for model in range(n_models):
+        mapping[np.arange(distinct.shape[1]), cells[model]] = 1
+    return (resampled @ mapping).reshape(n_bootstrap, n_models, n_labels, n_labels)
+
+
+def evaluate_predictions(y_true, y_pred, pos_label, n_bootstrap=0, confidence=0.95, seed=None):
+    """
+    Score a stack of predictions (one row per model) against one set of
+    true labels in a single pass.
+
+    Returns (confusion matrices, {metric: array over models}) where, when
+    `n_bootstrap` > 0, every metric also has '<metric>_ci_low' and
+    '<metric>_ci_high' percentile bootstrap bounds.
+    """
+    true_codes, pred_codes, labels = encode_labels(y_true, y_pred)
+    if pos_label not in labels:
+        raise ValueError(f"pos_label={pos_label} is not among the labels {labels.tolist()}")
+    pos_index = int(np.searchsorted(labels, pos_label))
+
+    confusion = confusion_counts(true_codes, pred_codes, len(labels))
+    metrics = metrics_from_confusion(confusion, pos_index)
+
+    if n_bootstrap > 0:
+        resampled = metrics_from_confusion(
+            bootstrap_confusion(true_codes, pred_codes, len(labels), n_bootstrap, seed), pos_index)
+        tail = (1 - confidence) / 2 * 100
+        for name in METRICS:
+            low, high = np.nanpercentile(resampled[name], [tail, 100 - tail], axis=0)
+            metrics[f'{name}_ci_low'] = low
+            metrics[f'{name}_ci_high'] = high
+    return confusion, metrics
+
+
+def threshold_sweep(y_true, scores, pos_label=1, cost_ratios=(1.0,)):
+    """
+    Metrics at every distinct score threshold from one sort of the scores.
+
+    A sample is flagged as `pos_label` when its score is at or above the
+    threshold. Counts at all thresholds come from cumulative sums over the
+    scores sorted in decreasing order, so the whole curve costs O(n log n).
+    The first entry (threshold inf) flags nothing.
+
+    `cost_ratios` are costs of a missed positive relative to a false alarm;
+    'cost_<ratio>' is the cost per sample, (false alarms + ratio * misses) / n.
+
+    Returns {column name: array over thresholds}.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    positive = np.asarray(y_true) == pos_label
+    n_rows = len(scores)
+
+    order = np.argsort(scores, kind='stable')[::-1]
+    sorted_scores = scores[order]
+    # Last position of every run of equal scores
+    ends = np.r_[np.flatnonzero(np.diff(sorted_scores)), n_rows - 1]
+
+    tp = np.r_[0, np.cumsum(positive[order])[ends]]
+    fp = np.r_[0, ends + 1] - tp
+    n_pos = positive.sum()
+    n_neg = n_rows - n_pos
+    fn = n_pos - tp
+    tn = n_neg - fp
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        recall = np.where(n_pos > 0, tp / n_pos, 0.0)
+        specificity = np.where(n_neg > 0, tn / n_neg, 0.0)
+        sweep = {
+            'threshold': np.r_[np.inf, sorted_scores[ends]],
+            'tp': tp, 'fp': fp, 'fn': fn, 'tn': tn,
+            'precision': np.where(tp + fp > 0, tp / (tp + fp), 0.0),
+            'recall': recall,
+            'balanced_accuracy': (recall + specificity) / 2
+        }
+    for ratio in cost_ratios:
+        sweep[f'cost_{ratio:g}'] = (fp + ratio * fn) / n_rows
+    return sweep
+
+
+def select_threshold(sweep, cost_ratio=None):
+    """
+    Pick the operating point of a threshold sweep: the lowest cost at
+    `cost_ratio` (which must be one of the sweep's ratios), or the highest
+    balanced accuracy when no ratio is given.
+
+    Returns {column name: value} at the chosen threshold.
+    """
+    if cost_ratio is None:
+        index = int(np.argmax(sweep['balanced_accuracy']))
+    else:
+        index = int(np.argmin(sweep[f'cost_{cost_ratio:g}']))
+    return {name: float(values[index]) for name, values in sweep.items()}
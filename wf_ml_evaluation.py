@@ -1,19 +1,81 @@
+import hashlib
+import json
 import os
 import pickle
+import tempfile
+import warnings
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+import numpy as np
 import pandas as pd
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import StandardScaler
+from sklearn.model_selection import RepeatedStratifiedKFold, train_test_split
+from threadpoolctl import threadpool_limits
 
+from wf_dataprocessing import nan_moments
+from wf_feature_selection import load_feature_manifest, select_data
 from wf_ml_evaluation_experimentation import conduct_feature_experiments
-from wf_ml_prediction import evaluate_models
-from wf_ml_training import train_classification_models
+from wf_ml_prediction import FAIL_LABEL, evaluate_models
+from wf_metrics import METRICS, evaluate_predictions
+from wf_ml_rolling import scaler_from_moments
+from wf_ml_training import build_models, compute_class_weight, train_classification_models
+from wf_model_registry import hash_training_data, load_best_params, load_model, model_cache_key
+from wf_profiling import PROFILER, measure, run_profiled
+from wf_storage import TIME_COLUMN, audit_dtype, load_secom, store_feature_dtype
 
+# Default split seed: a fixed split keeps the training data, and so the
+# model cache keys, stable between runs
+SPLIT_SEED = 0
 
-def split_and_prepare_data(df, target_column, test_size=0.2, standardize=True):
+# Not a .pkl, so it is never mistaken for a model by the models/*.pkl scans
+OUT_OF_FOLD_CACHE = "out_of_fold_scores.pickle"
+
+
+def _take_rows(df, columns, row_sets, dtype):
+    """
+    Gather the rows at each array of positions in `row_sets` into its own
+    preallocated, column-contiguous (Fortran ordered) matrix.
+
+    The frame is read one column at a time as a view of its block and each
+    column is gathered straight into its contiguous slot of the output, as
+    the columnar store lays the data out, so no intermediate copy of the
+    frame or of a column is made on the way.
+    """
+    outputs = [np.empty((len(rows), len(columns)), dtype=dtype, order='F') for rows in row_sets]
+    for j, column in enumerate(columns):
+        values = df[column].to_numpy()
+        for out, rows in zip(outputs, row_sets):
+            np.take(values, rows, out=out[:, j])
+    return outputs
+
+
+def _fit_scaler(values, feature_names, block_size=64):
+    """
+    StandardScaler fitted on `values` from moments computed over blocks of
+    `block_size` columns, so the float64 temporaries of the fit stay the
+    size of one block instead of the whole matrix.
+    """
+    blocks = [nan_moments(values[:, start:start + block_size].astype(np.float64))
+              for start in range(0, values.shape[1], block_size)]
+    moments = {name: np.concatenate([block[name] for block in blocks]) for name in ('count', 'mean', 'm2')}
+    return scaler_from_moments(moments, feature_names)
+
+
+def split_and_prepare_data(df, target_column, test_size=0.2, standardize=True, random_state=None,
+                           time_ordered=False, time_column=TIME_COLUMN):
     """
     Split data into training and test sets while ensuring minimum test set size
     and optionally standardizing features.
+
+    With `time_ordered` the rows are sorted by `time_column` and the latest
+    `test_size` fraction becomes the test set, as when scoring wafers that
+    arrive after the model was trained. The time column is never a feature.
+
+    Only row positions are split; the features are then copied once into
+    contiguous (column-major) train and test matrices, which are standardized in place, so
+    peak memory is about one copy of the data. The matrices are returned as
+    'X_train_values'/'X_test_values' (and the labels as 'y_train_values'/
+    'y_test_values'); 'X_train'/'X_test' are DataFrames wrapping them
+    without copying.
     """
     # Validate minimum dataset size
     min_required_samples = int(30 / test_size)  # Ensures at least 30 test samples
@@ -23,52 +85,64 @@ def split_and_prepare_data(df, target_column, test_size=0.2, standardize=True):
             f"to ensure {30} test samples with test_size={test_size}"
         )
 
-    # Separate features and target
-    X = df.drop(columns=[target_column])
-    y = df[target_column]
+    rows = np.arange(len(df))
+    if time_ordered:
+        rows = np.argsort(df[time_column].to_numpy(), kind='stable')
 
-    # Split the data
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y,
+    # Split the row positions
+    train_rows, test_rows = train_test_split(
+        rows,
         test_size=test_size,
+        random_state=random_state,
+        shuffle=not time_ordered
     )
 
     # Verify minimum test set size
-    if len(X_test) < 30:
+    if len(test_rows) < 30:
         raise ValueError(
-            f"Test set has {len(X_test)} samples. Minimum required is 30. "
+            f"Test set has {len(test_rows)} samples. Minimum required is 30. "
             "Please provide more data or adjust test_size."
         )
 
+    # Separate features and target; features keep their (common) precision
+    feature_columns = [col for col in df.columns if col not in (target_column, time_column)]
+    dtypes = df.dtypes
+    dtype = np.result_type(np.float32, *(dtypes[col] for col in feature_columns))
+    X_train_values, X_test_values = _take_rows(df, feature_columns, [train_rows, test_rows], dtype)
+    y = df[target_column].to_numpy()
+    y_train_values, y_test_values = y[train_rows], y[test_rows]
+
     # Initialize scaler as None
     scaler = None
 
-    # Standardize features if requested
+    # Standardize features if requested, in place as StandardScaler.transform would
     if standardize:
-        scaler = StandardScaler()
-        X_train = pd.DataFrame(
-            scaler.fit_transform(X_train),
-            columns=X_train.columns,
-            index=X_train.index
-        )
-        X_test = pd.DataFrame(
-            scaler.transform(X_test),
-            columns=X_test.columns,
-            index=X_test.index
-        )
+        scaler = _fit_scaler(X_train_values, feature_columns)
+        for values in (X_train_values, X_test_values):
+            values -= scaler.mean_
+            values /= scaler.scale_
 
     return {
-        'X_train': X_train,
-        'X_test': X_test,
-        'y_train': y_train,
-        'y_test': y_test,
-        'scaler': scaler
+        'X_train': pd.DataFrame(X_train_values, columns=feature_columns, index=df.index[train_rows], copy=False),
+        'X_test': pd.DataFrame(X_test_values, columns=feature_columns, index=df.index[test_rows], copy=False),
+        'y_train': pd.Series(y_train_values, index=df.index[train_rows], name=target_column, copy=False),
+        'y_test': pd.Series(y_test_values, index=df.index[test_rows], name=target_column, copy=False),
+        'X_train_values': X_train_values,
+        'X_test_values': X_test_values,
+        'y_train_values': y_train_values,
+        'y_test_values': y_test_values,
+        'scaler': scaler,
+        'random_state': random_state,
+        'time_ordered': time_ordered
     }
 
 
 def store_split_data(split_data, base_path="data_processed"):
     """
-    Store split data components using pickle format.
+    Store split data components as contiguous .npy arrays plus a column manifest.
+
+    Pickled splits (splits/<name>.pkl) left by the previous format are
+    removed, so stale copies of an older split cannot be loaded by mistake.
     """
     try:
         # Create base directory if it doesn't exist
@@ -81,21 +155,29 @@ def store_split_data(split_data, base_path="data_processed"):
 
         # Dictionary to store paths
         stored_paths = {}
+        arrays = {}
 
-        # Store training and test features
+        # Store training and test features as raw arrays; row labels are
+        # kept alongside so the frames can be rebuilt exactly
         for name, data in [
             ('X_train', split_data['X_train']),
             ('X_test', split_data['X_test']),
             ('y_train', split_data['y_train']),
             ('y_test', split_data['y_test'])
         ]:
-            # Create path
-            file_path = splits_dir / f"{name}.pkl"
-
-            # Save DataFrame using pickle
-            with open(file_path, 'wb') as f:
-                pickle.dump(data, f)
-
+            file_path = splits_dir / f"{name}.npy"
+            index_path = splits_dir / f"{name}_index.npy"
+            values = data.to_numpy()
+            np.save(file_path, values)
+            np.save(index_path, data.index.to_numpy())
+            (splits_dir / f"{name}.pkl").unlink(missing_ok=True)
+
+            arrays[name] = {
+                'file': file_path.name,
+                'index_file': index_path.name,
+                'dtype': values.dtype.name,
+                'shape': list(values.shape)
+            }
             stored_paths[name] = str(file_path)
 
         # Store scaler if present
@@ -105,17 +187,23 @@ def store_split_data(split_data, base_path="data_processed"):
                 pickle.dump(split_data['scaler'], f)
             stored_paths['scaler'] = str(scaler_path)
 
-        # Create metadata file with split information
+        # Create metadata file with split information; it doubles as the
+        # column manifest used to rebuild the frames on load
         metadata = {
             'train_samples': len(split_data['X_train']),
             'test_samples': len(split_data['X_test']),
             'features': list(split_data['X_train'].columns),
+            'target': split_data['y_train'].name,
+            'arrays': arrays,
+            'random_state': split_data.get('random_state'),
+            'time_ordered': split_data.get('time_ordered', False),
             'creation_date': pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S'),
             'has_scaler': split_data.get('scaler') is not None
         }
 
         metadata_path = model_dir / "split_metadata.json"
-        pd.Series(metadata).to_json(metadata_path)
+        with open(metadata_path, 'w') as f:
+            json.dump(metadata, f)
         stored_paths['metadata'] = str(metadata_path)
 
         return stored_paths
@@ -127,6 +215,9 @@ def store_split_data(split_data, base_path="data_processed"):
 def load_split_data(base_path="data_processed"):
     """
     Load previously stored split data components.
+
+    Arrays are memory mapped read-only and wrapped in DataFrames/Series
+    without copying, so loading costs no deserialization time.
     """
     try:
         model_dir = Path(base_path)
@@ -136,14 +227,21 @@ def load_split_data(base_path="data_processed"):
         if not splits_dir.exists():
             raise FileNotFoundError(f"Splits directory not found at {splits_dir}")
 
+        with open(model_dir / "split_metadata.json") as f:
+            metadata = json.load(f)
+
         # Load all components
         split_data = {}
 
         # Load features and targets
         for name in ['X_train', 'X_test', 'y_train', 'y_test']:
-            file_path = splits_dir / f"{name}.pkl"
-            with open(file_path, 'rb') as f:
-                split_data[name] = pickle.load(f)
+            info = metadata['arrays'][name]
+            values = np.load(splits_dir / info['file'], mmap_mode='r')
+            index = pd.Index(np.load(splits_dir / info['index_file']))
+            if name.startswith('X'):
+                split_data[name] = pd.DataFrame(values, index=index, columns=metadata['features'], copy=False)
+            else:
+                split_data[name] = pd.Series(values, index=index, name=metadata['target'], copy=False)
 
         # Load scaler if it exists
         scaler_path = model_dir / "scaler.pkl"
@@ -157,33 +255,321 @@ def load_split_data(base_path="data_processed"):
         raise IOError(f"Error loading split data: {str(e)}")
 
 
-def evaluate_data(run_experiment=False):
-    path_sep = os.path.sep
-    pickled_data = (
-            'data_processed'
-            + path_sep
-            + 'serialized'
-            + path_sep
-            + 'secom_output.pickle'
-    )
+def fold_plan(y, n_splits=5, n_repeats=1, random_state=0):
+    """
+    Stratified (repeated) K-fold plan: a list of (train rows, test rows),
+    computed once and shared by every model.
+    """
+    splitter = RepeatedStratifiedKFold(n_splits=n_splits, n_repeats=n_repeats, random_state=random_state)
+    return list(splitter.split(np.zeros(len(y)), y))
+
 
-    with open(pickled_data, 'rb') as f:
+def fold_scaler_statistics(X, plan):
+    """
+    StandardScaler mean and scale of every fold's training rows at once.
+
+    The training-row masks of all folds form one (folds x rows) matrix, so
+    the per-fold sums and sums of squares are two matrix products instead of
+    a scaler fit per fold. Columns are centred on the overall mean first to
+    keep the variance computation numerically stable. The statistics keep
+    the dtype of `X`, so scaling a float32 matrix does not upcast it.
+    """
+    masks = np.zeros((len(plan), len(X)), dtype=X.dtype)
+    for fold, (train_rows, _) in enumerate(plan):
+        masks[fold, train_rows] = 1.0
+    counts = masks.sum(axis=1, keepdims=True)
+
+    offset = X.mean(axis=0)
+    centred = X - offset
+    fold_means = masks @ centred / counts
+    variances = np.maximum(masks @ (centred * centred) / counts - fold_means ** 2, 0.0)
+    means = fold_means + offset
+    # Constant columns (up to rounding, which float32 makes visible) keep a
+    # unit scale, as in StandardScaler
+    scales = np.sqrt(variances)
+    scales[scales <= 10 * np.finfo(X.dtype).eps * np.abs(means)] = 1.0
+    return means, scales
+
+
+def _fit_fold_model(data_dir, train_rows, test_rows, mean, scale, model, n_threads=1, scores=False):
+    """
+    Fit one model on one fold of the shared, memory-mapped feature matrix.
+    Returns the test predictions, or with `scores` the test failure
+    probabilities (None for a model without predict_proba).
+    """
+    X = np.load(os.path.join(data_dir, 'X.npy'), mmap_mode='r')
+    y = np.load(os.path.join(data_dir, 'y.npy'), mmap_mode='r')
+    X_train = (X[train_rows] - mean) / scale
+    X_test = (X[test_rows] - mean) / scale
+
+    with threadpool_limits(limits=n_threads), warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        model.fit(X_train, y[train_rows])
+        if not scores:
+            return model.predict(X_test)
+        if not hasattr(model, 'predict_proba'):
+            return None
+        return model.predict_proba(X_test)[:, list(model.classes_).index(FAIL_LABEL)]
+
+
+def _fold_outputs(X, y, plan, category, max_workers=None, boosting_engine='exact', param_overrides=None,
+                  model_names=None, scores=False, knn_backend='sklearn'):
+    """
+    Fit every model (or those in `model_names`) on every fold of `plan` and
+    collect _fit_fold_model's output on the fold's test rows.
+
+    The per-fold scaler statistics are computed together (see
+    fold_scaler_statistics) and every (fold, model) fit is a separate task
+    in a process pool that reads the feature matrix from one shared
+    memory-mapped file; `max_workers=1` fits them in the current process.
+
+    Returns {(fold, model name): output} for the fits that succeeded.
+    """
+    with measure(f'{category}:scaler_statistics', category):
+        means, scales = fold_scaler_statistics(X, plan)
+
+    max_workers = max(1, max_workers or os.cpu_count() or 1)
+    outputs = {}
+    with tempfile.TemporaryDirectory() as data_dir:
+        np.save(os.path.join(data_dir, 'X.npy'), X)
+        np.save(os.path.join(data_dir, 'y.npy'), y)
+
+        tasks = {}
+        for fold, (train_rows, test_rows) in enumerate(plan):
+            models = build_models(X[train_rows], compute_class_weight(y[train_rows]), n_jobs=1,
+                                  knn_backend=knn_backend, boosting_engine=boosting_engine)
+            for model_name, model in models.items():
+                if model_names is not None and model_name not in model_names:
+                    continue
+                model.set_params(**(param_overrides or {}).get(model_name, {}))
+                tasks[fold, model_name] = (data_dir, train_rows, test_rows, means[fold], scales[fold], model)
+
+        if max_workers == 1:
+            for (fold, model_name), args in tasks.items():
+                try:
+                    with measure(f"{category}:fold_{fold}:{model_name}", category):
+                        outputs[fold, model_name] = _fit_fold_model(*args, scores=scores)
+                except Exception as e:
+                    print(f"Error cross-validating {model_name} on fold {fold}: {str(e)}")
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                futures = {
+                    key: executor.submit(run_profiled, _fit_fold_model, f"{category}:fold_{key[0]}:{key[1]}",
+                                         category, *args, scores=scores)
+                    for key, args in tasks.items()
+                }
+                for (fold, model_name), future in futures.items():
+                    try:
+                        outputs[fold, model_name], records = future.result()
+                        PROFILER.add_records(records)
+                    except Exception as e:
+                        print(f"Error cross-validating {model_name} on fold {fold}: {str(e)}")
+    return outputs
+
+
+def out_of_fold_scores(X, y, n_splits=3, random_state=SPLIT_SEED, max_workers=None, boosting_engine='exact',
+                       param_overrides=None, model_dir="models", knn_backend='sklearn'):
+    """
+    Out-of-fold failure probabilities of every model on its training data.
+
+    Each model is refit on stratified K-fold splits of (X, y) and scores the
+    held-out fold, so every row is scored by a model that never saw it;
+    operating thresholds chosen on these scores are not tuned on the test
+    set. With a fixed `random_state` the scores are cached next to the models
+    in out_of_fold_scores.pickle, keyed like the model cache, so unchanged
+    models are not refit.
+
+    Returns:
+    {model name: scores over the rows of X} for models with predict_proba
+    """
+    models = build_models(X, compute_class_weight(y), n_jobs=1, knn_backend=knn_backend,
+                          boosting_engine=boosting_engine)
+    for model_name, model in models.items():
+        model.set_params(**(param_overrides or {}).get(model_name, {}))
+
+    cache_path = Path(model_dir) / OUT_OF_FOLD_CACHE
+    cache = {}
+    if random_state is not None and cache_path.exists():
         try:
-            data_f = pd.DataFrame(pickle.load(f))
-            split_data = split_and_prepare_data(data_f, target_column='pass')
+            with open(cache_path, 'rb') as f:
+                cache = pickle.load(f)
+        except Exception as e:
+            print(f"Could not read {cache_path}, recomputing: {str(e)}")
+    data_hash = hashlib.sha256(f"{hash_training_data(X, y)}:{n_splits}:{random_state}".encode('utf-8')).hexdigest()
+    keys = {name: model_cache_key(data_hash, model) for name, model in models.items()}
+
+    result = {name: cache[name]['scores'] for name in models
+              if name in cache and cache[name]['key'] == keys[name]}
+    pending = [name for name in models if name not in result]
+    if pending:
+        values = X.to_numpy()
+        labels = np.asarray(y)
+        plan = fold_plan(labels, n_splits, 1, random_state)
+        outputs = _fold_outputs(values, labels, plan, 'oof', max_workers, boosting_engine, param_overrides,
+                                model_names=pending, scores=True, knn_backend=knn_backend)
+        for model_name in pending:
+            folds = [outputs.get((fold, model_name)) for fold in range(len(plan))]
+            if any(scores is None for scores in folds):
+                continue
+            scores = np.empty(len(labels))
+            for (_, test_rows), fold_scores in zip(plan, folds):
+                scores[test_rows] = fold_scores
+            result[model_name] = scores
+            cache[model_name] = {'key': keys[model_name], 'scores': scores}
+
+        if random_state is not None:
+            try:
+                cache_path.parent.mkdir(parents=True, exist_ok=True)
+                with open(cache_path, 'wb') as f:
+                    pickle.dump(cache, f)
+            except Exception as e:
+                print(f"Warning: Could not save out-of-fold scores: {str(e)}")
+    return result
+
+
+def cross_validate_models(df, target_column='pass', n_splits=5, n_repeats=1, random_state=0, max_workers=None,
+                          boosting_engine='exact', param_overrides=None, output_dir="evaluation",
+                          knn_backend='sklearn'):
+    """
+    Evaluate all four models with stratified (repeated) K-fold cross-validation.
+
+    One fold plan is shared by every model and each (fold, model) fit is a
+    separate task (see _fold_outputs). Predictions of all models on a fold
+    are scored in one pass of the metrics kernel.
+
+    Per-fold metrics are written to cv_results.csv and the mean and standard
+    deviation of every metric per model to cv_summary.txt.
+
+    Returns:
+    DataFrame of per-fold metrics (one row per fold and model)
+    """
+    feature_columns = [col for col in df.columns if col not in (target_column, TIME_COLUMN)]
+    X = df[feature_columns].to_numpy()
+    y = df[target_column].to_numpy()
+
+    plan = fold_plan(y, n_splits, n_repeats, random_state)
+    outputs = _fold_outputs(X, y, plan, 'cv', max_workers, boosting_engine, param_overrides,
+                            knn_backend=knn_backend)
+
+    results = []
+    for fold, (_, test_rows) in enumerate(plan):
+        names = [name for (f, name) in outputs if f == fold]
+        if not names:
+            continue
+        _, scores = evaluate_predictions(y[test_rows], np.vstack([outputs[fold, name] for name in names]),
+                                         pos_label=-1)
+        for i, model_name in enumerate(names):
+            results.append({
+                'repeat': fold // n_splits,
+                'fold': fold % n_splits,
+                'model_name': model_name,
+                **{metric: float(scores[metric][i]) for metric in METRICS}
+            })
+
+    results_df = pd.DataFrame(results)
+    try:
+        output_path = Path(output_dir)
+        output_path.mkdir(parents=True, exist_ok=True)
+        results_df.to_csv(output_path / "cv_results.csv", index=False)
+
+        summary = results_df.groupby('model_name', sort=False)[METRICS].agg(['mean', 'std'])
+        lines = [
+            "CROSS-VALIDATION SUMMARY",
+            "=" * 80,
+            f"Evaluation Date: {pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S')}",
+            f"Folds: {n_splits} x {n_repeats} repeat(s), {len(y)} samples",
+            "=" * 80 + "\n"
+        ]
+        for model_name, row in summary.iterrows():
+            lines.append(f"MODEL: {model_name.upper()}")
+            lines.append("-" * 80)
+            for metric in METRICS:
+                lines.append(f"  {metric.replace('_', ' ').title()}: "
+                             f"{row[(metric, 'mean')]:.3f} \u00b1 {row[(metric, 'std')]:.3f}")
+            lines.append("\n" + "=" * 80 + "\n")
+        with open(output_path / "cv_summary.txt", 'w') as f:
+            f.write('\n'.join(lines))
+    except Exception as e:
+        print(f"Warning: Could not save cross-validation results: {str(e)}")
+
+    return results_df
+
+
+def evaluate_data(run_experiment=False, random_state=SPLIT_SEED, render=True, prune_features=False,
+                  boosting_engine='exact', time_ordered=False, tuned=False, cv_folds=None, cv_repeats=1,
+                  permutation_importances=False, threshold_folds=3, knn_backend='sklearn'):
+    """
+    Split, train, evaluate and optionally run the feature experiments.
+
+    The split is seeded with `random_state` (SPLIT_SEED by default), so models
+    are only retrained when the data or their parameters change; pass None
+    for a fresh random split every run. `render=False` skips
+    the evaluation and experiment plots. With `prune_features` only the columns kept by the
+    feature manifest are loaded (the manifest is fitted if missing); by
+    default the models see every feature.
+    `boosting_engine='histogram'` trains gradient_boosting, which also feeds
+    the experiments, with the histogram engine. `knn_backend` picks the KNN
+    implementation (see wf_ml_training.build_knn). `time_ordered` tests on the
+    most recent wafers instead of a random sample. `tuned` trains with the
+    parameters found by the hyperparameter search (see wf_ml_search).
+    `permutation_importances` plots permutation importances for the
+    histogram engine, which has no fitted ones (see evaluate_models).
+    Operating thresholds are chosen on `threshold_folds`-fold out-of-fold
+    scores of the training split (see out_of_fold_scores) and only reported
+    on the test set; 0 skips choosing them.
+
+    With `cv_folds` the models are instead evaluated by stratified K-fold
+    cross-validation repeated `cv_repeats` times (see cross_validate_models).
+    """
+    try:
+        columns = None
+        if prune_features:
+            manifest = load_feature_manifest() or select_data()
+            columns = ['pass', TIME_COLUMN] + manifest['kept']
+        # Every step keeps the precision the store was written with
+        dtype = store_feature_dtype()
+        with measure('evaluate:load', 'io'):
+            data_f = audit_dtype(load_secom(columns), dtype, 'evaluate:load')
+        if cv_folds:
+            with measure('evaluate:cv', 'evaluate'):
+                cross_validate_models(data_f, target_column='pass', n_splits=cv_folds, n_repeats=cv_repeats,
+                                      random_state=random_state, knn_backend=knn_backend,
+                                      boosting_engine=boosting_engine,
+                                      param_overrides=load_best_params(boosting_engine) if tuned else None)
+            return
+        with measure('evaluate:split', 'split'):
+            split_data = split_and_prepare_data(data_f, target_column='pass', random_state=random_state,
+                                                time_ordered=time_ordered)
+            audit_dtype(split_data['X_train'], dtype, 'evaluate:split')
+            audit_dtype(split_data['X_test'], dtype, 'evaluate:split')
             store_split_data(split_data)
-            split_data = load_split_data()
-            train_classification_models(split_data['X_train'], split_data['y_train'])
-            evaluate_models(split_data['X_test'], split_data['y_test'])
-            if run_experiment:
-                model_path = Path("models/gradient_boosting.pkl")
-                with open(model_path, 'rb') as f_exp:
-                    scaler_path = Path("data_processed/scaler.pkl")
-                    with open(scaler_path, 'rb') as f_scl:
-                        model = pickle.load(f_exp)
-                        scaler = pickle.load(f_scl)
-                        conduct_feature_experiments(model, split_data['X_test'], scaler)
-
-        except Exception as err:
-            print(err)
-            pass
\ No newline at end of file
+        param_overrides = load_best_params(boosting_engine) if tuned else None
+        with measure('evaluate:train', 'train'):
+            train_classification_models(split_data['X_train'], split_data['y_train'], knn_backend=knn_backend,
+                                        boosting_engine=boosting_engine, param_overrides=param_overrides)
+        validation = None
+        if threshold_folds:
+            with measure('evaluate:out_of_fold', 'evaluate'):
+                validation = (split_data['y_train'],
+                              out_of_fold_scores(split_data['X_train'], split_data['y_train'], threshold_folds,
+                                                 random_state, boosting_engine=boosting_engine,
+                                                 param_overrides=param_overrides, knn_backend=knn_backend))
+        with measure('evaluate:models', 'evaluate'):
+            evaluate_models(split_data['X_test'], split_data['y_test'], render=render,
+                            permutation_importances=permutation_importances, validation=validation)
+        if run_experiment:
+            dropped = [name for name in ('feature_516', 'feature_244') if name not in split_data['X_test']]
+            if dropped:
+                print("=" * 80)
+                print(f"WARNING: skipping the feature experiments: {', '.join(dropped)} "
+                      f"dropped by feature selection (run with prune_features=False to include them)")
+                print("=" * 80)
+                return
+            with measure('evaluate:experiment', 'experiment'):
+                model = load_model(Path("models/gradient_boosting.pkl"))
+                conduct_feature_experiments(model, split_data['X_test'], split_data['scaler'], render=render)
+
+    except Exception as err:
+        # Re-raised so the pipeline records the stage as failed
+        print(err)
+        raise
\ No newline at end of file
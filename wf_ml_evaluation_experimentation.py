@@ -4,16 +4,62 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 from pathlib import Path
 
-
-def conduct_feature_experiments(model, X_test, scaler=None, output_dir="evaluation/experiment_results"):
+from wf_ml_partial_dependence import partial_dependence
+from wf_rendering import plot_spec, released_figure, render_plots
+
+
+def plot_individual_impacts(first_label, first_range, first_probs, second_label, second_range, second_probs,
+                            save_path):
+    """Create and save the two single-feature partial dependence curves side by side."""
+    with released_figure(figsize=(12, 5)):
+        plt.subplot(1, 2, 1)
+        plt.plot(first_range, first_probs)
+        plt.title(f'{first_label} Impact on Pass Probability')
+        plt.xlabel(f'{first_label} Value')
+        plt.ylabel('Pass Probability')
+
+        plt.subplot(1, 2, 2)
+        plt.plot(second_range, second_probs)
+        plt.title(f'{second_label} Impact on Pass Probability')
+        plt.xlabel(f'{second_label} Value')
+        plt.ylabel('Pass Probability')
+
+        plt.tight_layout()
+        plt.savefig(save_path / 'individual_feature_impacts.png')
+
+
+def plot_interaction_heatmap(heatmap_data, first_label, first_range, second_label, second_range, save_path):
+    """Create and save the heatmap of the joint partial dependence of two features."""
+    with released_figure(figsize=(10, 8)):
+        tick_step = max(1, len(first_range) // 10)
+        sns.heatmap(heatmap_data,
+                    xticklabels=np.round(second_range[::tick_step], 2),
+                    yticklabels=np.round(first_range[::tick_step], 2),
+                    cmap='coolwarm')
+        plt.title('Combined Feature Impact on Pass Probability')
+        plt.xlabel(f'{second_label} Value')
+        plt.ylabel(f'{first_label} Value')
+        plt.tight_layout()
+        plt.savefig(save_path / 'feature_interaction_heatmap.png')
+
+
+def conduct_feature_experiments(model, X_test, scaler=None, output_dir="evaluation/experiment_results",
+                                grid_size=50, features=('feature_516', 'feature_244'), max_workers=1,
+                                render=True, render_workers=None):
     """
-    Conduct experiments varying feature_516 and feature_244 values to analyze their impact on predictions.
+    Conduct experiments varying two feature values (feature_516 and feature_244 by default)
+    to analyze their impact on predictions.
 
     Parameters:
     model: trained sklearn model
     X_test: pandas DataFrame with test data
     scaler: optional StandardScaler used in training
     output_dir: directory to save visualization results
+    grid_size: number of values per feature in each sweep
+    features: the pair of features to vary
+    max_workers: processes used to evaluate the grids
+    render: render the plots (see wf_rendering.render_plots)
+    render_workers: processes used to render the plots
 
     Returns:
     dict containing experiment results and analysis
@@ -21,102 +67,39 @@ def conduct_feature_experiments(model, X_test, scaler=None, output_dir="evaluati
     output_path = Path(output_dir)
     output_path.mkdir(parents=True, exist_ok=True)
 
-    # Create synthetic data points for experimentation
-    def create_synthetic_point(base_point, feature_516_val, feature_244_val):
-        new_point = base_point.copy()
-        new_point['feature_516'] = feature_516_val
-        new_point['feature_244'] = feature_244_val
-        return new_point
-
-    # Get feature ranges from test data
-    feature_516_range = np.linspace(X_test['feature_516'].min(), X_test['feature_516'].max(), 50)
-    feature_244_range = np.linspace(X_test['feature_244'].min(), X_test['feature_244'].max(), 50)
-
-    # Base point for experimentation (using median values)
-    base_point = pd.DataFrame([X_test.median()], columns=X_test.columns)
-
-    # Experiment 1: Varying feature_516
-    feature_516_results = []
-    for val in feature_516_range:
-        test_point = create_synthetic_point(base_point, val, base_point['feature_244'].iloc[0])
-        if scaler:
-            test_point_scaled = pd.DataFrame(scaler.transform(test_point), columns=test_point.columns)
-            pred = model.predict_proba(test_point_scaled)[0]
-        else:
-            pred = model.predict_proba(test_point)[0]
-        feature_516_results.append({'value': val, 'pass_prob': pred[0]})
-
-    # Experiment 2: Varying feature_244
-    feature_244_results = []
-    for val in feature_244_range:
-        test_point = create_synthetic_point(base_point, base_point['feature_516'].iloc[0], val)
-        if scaler:
-            test_point_scaled = pd.DataFrame(scaler.transform(test_point), columns=test_point.columns)
-            pred = model.predict_proba(test_point_scaled)[0]
-        else:
-            pred = model.predict_proba(test_point)[0]
-        feature_244_results.append({'value': val, 'pass_prob': pred[0]})
-
-    # Experiment 3: Varying both features
-    heatmap_data = np.zeros((len(feature_516_range), len(feature_244_range)))
-    for i, val_516 in enumerate(feature_516_range):
-        for j, val_244 in enumerate(feature_244_range):
-            test_point = create_synthetic_point(base_point, val_516, val_244)
-            if scaler:
-                test_point_scaled = pd.DataFrame(scaler.transform(test_point), columns=test_point.columns)
-                pred = model.predict_proba(test_point_scaled)[0]
-            else:
-                pred = model.predict_proba(test_point)[0]
-            heatmap_data[i, j] = pred[0]
-
-    # Create visualizations
-    # Individual feature plots
-    plt.figure(figsize=(12, 5))
-
-    plt.subplot(1, 2, 1)
-    plt.plot([x['value'] for x in feature_516_results],
-             [x['pass_prob'] for x in feature_516_results])
-    plt.title('Feature 516 Impact on Pass Probability')
-    plt.xlabel('Feature 516 Value')
-    plt.ylabel('Pass Probability')
-
-    plt.subplot(1, 2, 2)
-    plt.plot([x['value'] for x in feature_244_results],
-             [x['pass_prob'] for x in feature_244_results])
-    plt.title('Feature 244 Impact on Pass Probability')
-    plt.xlabel('Feature 244 Value')
-    plt.ylabel('Pass Probability')
-
-    plt.tight_layout()
-    plt.savefig(output_path / 'individual_feature_impacts.png')
-    plt.close()
-
-    # Heatmap for combined effects
-    plt.figure(figsize=(10, 8))
-    sns.heatmap(heatmap_data,
-                xticklabels=np.round(feature_244_range[::5], 2),
-                yticklabels=np.round(feature_516_range[::5], 2),
-                cmap='coolwarm')
-    plt.title('Combined Feature Impact on Pass Probability')
-    plt.xlabel('Feature 244 Value')
-    plt.ylabel('Feature 516 Value')
-    plt.tight_layout()
-    plt.savefig(output_path / 'feature_interaction_heatmap.png')
-    plt.close()
+    first, second = features
+    first_label = first.replace('feature_', 'Feature ')
+    second_label = second.replace('feature_', 'Feature ')
+
+    # Vary the features around the median test point (experiments 1 and 2)
+    # and jointly over their grid (experiment 3)
+    dependence = partial_dependence(model, X_test, [first, second], grid_size=grid_size,
+                                    scaler=scaler, base='median', max_workers=max_workers)
+    first_range = dependence['grids'][first]
+    second_range = dependence['grids'][second]
+    first_probs = dependence['individual'][first]
+    second_probs = dependence['individual'][second]
+    heatmap_data = dependence['pairwise'][(first, second)]
+
+    # Individual feature curves and a heatmap of the combined effects
+    render_plots([
+        plot_spec(plot_individual_impacts, first_label, first_range, first_probs,
+                  second_label, second_range, second_probs, output_path),
+        plot_spec(plot_interaction_heatmap, heatmap_data, first_label, first_range,
+                  second_label, second_range, output_path)
+    ], max_workers=render_workers, enabled=render)
 
     # Calculate results
     results = {
-        'feature_516': {
-            'min_effect': min(x['pass_prob'] for x in feature_516_results),
-            'max_effect': max(x['pass_prob'] for x in feature_516_results),
-            'range': max(x['pass_prob'] for x in feature_516_results) -
-                     min(x['pass_prob'] for x in feature_516_results)
+        first: {
+            'min_effect': np.min(first_probs),
+            'max_effect': np.max(first_probs),
+            'range': np.max(first_probs) - np.min(first_probs)
         },
-        'feature_244': {
-            'min_effect': min(x['pass_prob'] for x in feature_244_results),
-            'max_effect': max(x['pass_prob'] for x in feature_244_results),
-            'range': max(x['pass_prob'] for x in feature_244_results) -
-                     min(x['pass_prob'] for x in feature_244_results)
+        second: {
+            'min_effect': np.min(second_probs),
+            'max_effect': np.max(second_probs),
+            'range': np.max(second_probs) - np.min(second_probs)
         },
         'combined': {
             'min_effect': np.min(heatmap_data),
@@ -132,24 +115,24 @@ def conduct_feature_experiments(model, X_test, scaler=None, output_dir="evaluati
         f"Experiment Date: {pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S')}",
         "=" * 80 + "\n",
 
-        "EXPERIMENT 1: VARYING FEATURE 516",
+        f"EXPERIMENT 1: VARYING {first_label.upper()}",
         "-" * 80,
-        f"Minimum Pass Probability: {results['feature_516']['min_effect']:.3f}",
-        f"Maximum Pass Probability: {results['feature_516']['max_effect']:.3f}",
-        f"Effect Range: {results['feature_516']['range']:.3f}",
+        f"Minimum Pass Probability: {results[first]['min_effect']:.3f}",
+        f"Maximum Pass Probability: {results[first]['max_effect']:.3f}",
+        f"Effect Range: {results[first]['range']:.3f}",
         "Analysis:",
-        f"  -> Feature 516 can swing predictions by {results['feature_516']['range'] * 100:.1f}%",
-        f"  -> Strongest positive effect at value {feature_516_range[np.argmax([x['pass_prob'] for x in feature_516_results])]:.2f}",
+        f"  -> {first_label} can swing predictions by {results[first]['range'] * 100:.1f}%",
+        f"  -> Strongest positive effect at value {first_range[np.argmax(first_probs)]:.2f}",
         "\n" + "=" * 80 + "\n",
 
-        "EXPERIMENT 2: VARYING FEATURE 244",
+        f"EXPERIMENT 2: VARYING {second_label.upper()}",
         "-" * 80,
-        f"Minimum Pass Probability: {results['feature_244']['min_effect']:.3f}",
-        f"Maximum Pass Probability: {results['feature_244']['max_effect']:.3f}",
-        f"Effect Range: {results['feature_244']['range']:.3f}",
+        f"Minimum Pass Probability: {results[second]['min_effect']:.3f}",
+        f"Maximum Pass Probability: {results[second]['max_effect']:.3f}",
+        f"Effect Range: {results[second]['range']:.3f}",
         "Analysis:",
-        f"  -> Feature 244 can swing predictions by {results['feature_244']['range'] * 100:.1f}%",
-        f"  -> Strongest positive effect at value {feature_244_range[np.argmax([x['pass_prob'] for x in feature_244_results])]:.2f}",
+        f"  -> {second_label} can swing predictions by {results[second]['range'] * 100:.1f}%",
+        f"  -> Strongest positive effect at value {second_range[np.argmax(second_probs)]:.2f}",
         "\n" + "=" * 80 + "\n",
 
         "EXPERIMENT 3: VARYING BOTH FEATURES",
@@ -159,7 +142,7 @@ def conduct_feature_experiments(model, X_test, scaler=None, output_dir="evaluati
         f"Combined Effect Range: {results['combined']['range']:.3f}",
         "Analysis:",
         f"  -> Combined features can swing predictions by {results['combined']['range'] * 100:.1f}%",
-        f"  -> Interaction strength: {(results['combined']['range'] - max(results['feature_516']['range'], results['feature_244']['range'])) * 100:.1f}% additional effect",
+        f"  -> Interaction strength: {(results['combined']['range'] - max(results[first]['range'], results[second]['range'])) * 100:.1f}% additional effect",
         "\n" + "=" * 80 + "\n",
     ]
 
@@ -167,4 +150,4 @@ def conduct_feature_experiments(model, X_test, scaler=None, output_dir="evaluati
     with open(output_path / "experiment_summary.txt", 'w') as f:
         f.write('\n'.join(summary_lines))
 
-    return results
\ No newline at end of file
+    return results
@@ -0,0 +1,251 @@
+import argparse
+import os
+import pickle
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import SGDClassifier
+from sklearn.preprocessing import StandardScaler
+
+from wf_dataprocessing import (impute_class_conditional, load_imputation_stats, read_features, read_labels,
+                               unconditional_fill_values)
+from wf_feature_selection import load_feature_manifest
+from wf_model_registry import load_model, register_model
+from wf_profiling import measure
+from wf_storage import FEATURE_MANIFEST, IMPUTATION_STATS, TIME_COLUMN
+
+# Kept out of models/*.pkl so batch evaluation and WaferScorer don't pick it up
+ONLINE_MODEL = os.path.join('models', 'online', 'sgd_logistic.pkl')
+CLASSES = np.array([-1, 1])
+N_FEATURES = 590
+
+
+def _feature_columns(feature_names):
+    all_features = [f'feature_{i}' for i in range(N_FEATURES)]
+    return np.array([all_features.index(name) for name in feature_names])
+
+
+class OnlineWaferModel:
+    """
+    Logistic regression trained by SGD on labelled wafer lots as they arrive.
+
+    Each lot is imputed class-conditionally with the imputation statistics
+    from mung_data, projected onto the feature manifest, folded into the
+    scaler with `partial_fit` and then into the classifier with one
+    `partial_fit` pass, so ingesting a lot costs time proportional to the lot.
+    Class weights follow compute_class_weight but use the running class
+    counts of everything ingested so far.
+
+    The model is checkpointed to `path` every `checkpoint_every` lots or
+    `checkpoint_interval` seconds, whichever comes first. A checkpoint is a
+    plain dict of the learned state (see state), so it loads wherever the
+    module is importable, including after being written by the CLI.
+    """
+
+    def __init__(self, path=ONLINE_MODEL, stats_path=IMPUTATION_STATS, manifest_path=FEATURE_MANIFEST,
+                 checkpoint_every=10, checkpoint_interval=None, alpha=1e-4, seed=None):
+        self.path = path
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_interval = checkpoint_interval
+
+        self.stats = load_imputation_stats(stats_path)
+        self.fill_values = unconditional_fill_values(self.stats)
+        manifest = load_feature_manifest(manifest_path)
+        self.feature_names = (manifest['kept'] if manifest is not None
+                              else [f'feature_{i}' for i in range(N_FEATURES)])
+        self.columns = _feature_columns(self.feature_names)
+
+        self.scaler = StandardScaler()
+        self.classifier = SGDClassifier(loss='log_loss', alpha=alpha, random_state=seed)
+        self.rng = np.random.default_rng(seed)
+        self.class_counts = np.zeros(len(CLASSES), dtype=np.int64)
+        self.lots = 0
+        self._unsaved_lots = 0
+        self._last_checkpoint = time.monotonic()
+
+    @property
+    def rows_seen(self):
+        return int(self.class_counts.sum())
+
+    def _frame(self, values):
+        if len(self.columns) != values.shape[1]:
+            values = values[:, self.columns]
+        return pd.DataFrame(values, columns=self.feature_names, copy=False)
+
+    def _sample_weight(self, labels):
+        # Balanced weights with an extra 20% on failed wafers, as in
+        # compute_class_weight, over every wafer ingested so far
+        counts = np.maximum(self.class_counts, 1)
+        weights = self.rows_seen / (len(CLASSES) * counts) * np.array([1.0, 1.2])
+        return weights[np.searchsorted(CLASSES, labels)]
+
+    def ingest(self, rows, labels):
+        """
+        Update the scaler and classifier with one lot of raw labelled wafers.
+        """
+        values = np.array(rows, dtype=np.float64, ndmin=2)
+        labels = np.asarray(labels)
+        if values.shape[1] != N_FEATURES:
+            raise ValueError(f"Expected {N_FEATURES} features per wafer, got {values.shape[1]}")
+        if not np.isin(labels, CLASSES).all():
+            raise ValueError(f"Labels must be one of {CLASSES.tolist()}")
+
+        with measure('online:ingest', 'online'):
+            impute_class_conditional(values, labels, self.stats, self.rng)
+            # Features with no class statistics fall back to the unconditional fill
+            missing = np.isnan(values)
+            if missing.any():
+                values[missing] = np.broadcast_to(self.fill_values, values.shape)[missing]
+
+            frame = self._frame(values)
+            self.class_counts += np.bincount(np.searchsorted(CLASSES, labels), minlength=len(CLASSES))
+            self.scaler.partial_fit(frame)
+            scaled = pd.DataFrame(self.scaler.transform(frame), columns=self.feature_names, copy=False)
+            self.classifier.partial_fit(scaled, labels, classes=CLASSES,
+                                        sample_weight=self._sample_weight(labels))
+
+        self.lots += 1
+        self._unsaved_lots += 1
+        if self._checkpoint_due():
+            self.checkpoint()
+        return self
+
+    def _checkpoint_due(self):
+        if self.checkpoint_every is not None and self._unsaved_lots >= self.checkpoint_every:
+            return True
+        return (self.checkpoint_interval is not None
+                and time.monotonic() - self._last_checkpoint >= self.checkpoint_interval)
+
+    def state(self):
+        """
+        The learned state: feature names, scaler, classifier, class counts,
+        lot count and random generator state.
+        """
+        return {
+            'feature_names': list(self.feature_names),
+            'scaler': self.scaler,
+            'classifier': self.classifier,
+            'class_counts': self.class_counts,
+            'lots': self.lots,
+            'rng_state': self.rng.bit_generator.state
+        }
+
+    @classmethod
+    def from_state(cls, state, **kwargs):
+        """
+        Rebuild a model from a checkpointed state; the imputation statistics
+        are read afresh, the features are those the classifier was fit on.
+        """
+        model = cls(**kwargs)
+        model.feature_names = state['feature_names']
+        model.columns = _feature_columns(model.feature_names)
+        model.scaler = state['scaler']
+        model.classifier = state['classifier']
+        model.class_counts = np.array(state['class_counts'], dtype=np.int64)
+        model.lots = state['lots']
+        model.rng.bit_generator.state = state['rng_state']
+        return model
+
+    def checkpoint(self):
+        """
+        Atomically write the model's state to its path.
+        """
+        path = Path(self.path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix('.tmp')
+        state = self.state()
+        with measure('online:checkpoint', 'io'):
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(state, f)
+            os.replace(tmp_path, path)
+        register_model(path, state)
+        self._unsaved_lots = 0
+        self._last_checkpoint = time.monotonic()
+        return path
+
+    def predict_proba(self, rows):
+        """
+        Class probabilities of raw wafers (columns follow `classifier.classes_`).
+        """
+        values = np.array(rows, dtype=np.float64, ndmin=2)
+        missing = np.isnan(values)
+        if missing.any():
+            values[missing] = np.broadcast_to(self.fill_values, values.shape)[missing]
+        scaled = self.scaler.transform(self._frame(values))
+        return self.classifier.predict_proba(pd.DataFrame(scaled, columns=self.feature_names, copy=False))
+
+    def predict(self, rows):
+        return self.classifier.classes_[np.argmax(self.predict_proba(rows), axis=1)]
+
+
+def load_online_model(path=ONLINE_MODEL, **kwargs):
+    """
+    Resume the checkpointed online model, or start a new one if none exists.
+    """
+    if os.path.exists(path):
+        state = load_model(path)
+        # Checkpoints written before they became state dicts hold the model itself
+        if isinstance(state, OnlineWaferModel):
+            return state
+        return OnlineWaferModel.from_state(state, path=path, **kwargs)
+    return OnlineWaferModel(path=path, **kwargs)
+
+
+def bootstrap_online_model(lot_size=100, path=ONLINE_MODEL, **kwargs):
+    """
+    Start an online model from the raw history, replayed in time order as
+    lots of `lot_size` wafers exactly as new lots would arrive.
+    """
+    labels = read_labels(os.path.join('data_original', 'secom_labels.data'))
+    features = read_features(os.path.join('data_original', 'secom.data')).to_numpy()
+    order = np.argsort(labels[TIME_COLUMN].to_numpy(), kind='stable')
+
+    model = OnlineWaferModel(path=path, **kwargs)
+    classes = labels['pass'].to_numpy()
+    for start in range(0, len(order), lot_size):
+        lot = order[start:start + lot_size]
+        model.ingest(features[lot], classes[lot])
+    model.checkpoint()
+    return model
+
+
+def ingest_lot(labels_path, features_path, path=ONLINE_MODEL):
+    """
+    Ingest one lot given as SECOM-format label and feature files.
+    """
+    model = load_online_model(path)
+    labels = read_labels(labels_path)
+    features = read_features(features_path)
+    if len(labels) != len(features):
+        raise ValueError(f"Lot has {len(labels)} labels but {len(features)} feature rows")
+    model.ingest(features.to_numpy(), labels['pass'].to_numpy())
+    return model
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Update the online SECOM model with newly labelled wafers.')
+    parser.add_argument('--bootstrap', action='store_true',
+                        help='start a new model from the historical SECOM data')
+    parser.add_argument('--lot-size', type=int, default=100, help='wafers per replayed lot when bootstrapping')
+    parser.add_argument('--labels', help='labels file of a new lot (secom_labels.data format)')
+    parser.add_argument('--features', help='features file of a new lot (secom.data format)')
+    args = parser.parse_args(argv)
+
+    if args.bootstrap:
+        model = bootstrap_online_model(args.lot_size)
+    elif args.labels and args.features:
+        model = ingest_lot(args.labels, args.features)
+        # A single command-line lot is always persisted
+        model.checkpoint()
+    else:
+        parser.error('pass --bootstrap or both --labels and --features')
+
+    print(f"Online model has ingested {model.lots} lots, {model.rows_seen} wafers; saved to {model.path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,167 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+
+# Per-process state for pool workers, set once by _init_worker
+_WORKER_STATE = {}
+
+
+def scale_columns(scaler, columns, values):
+    """
+    Apply a fitted StandardScaler analytically to the given column positions.
+
+    `values` has one column per entry in `columns`.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if scaler is None:
+        return values
+    mean = scaler.mean_[columns] if scaler.mean_ is not None else 0.0
+    scale = scaler.scale_[columns] if scaler.scale_ is not None else 1.0
+    return (values - mean) / scale
+
+
+def feature_grid(X, feature, grid_size):
+    """
+    Evenly spaced values spanning the observed range of `feature`.
+    """
+    return np.linspace(X[feature].min(), X[feature].max(), grid_size)
+
+
+def plan_chunks(n_base, n_points, n_features, chunk_bytes):
+    """
+    Split an (n_base x n_points) evaluation into blocks whose float64 batch
+    of synthetic rows (each `n_features` wide) fits in `chunk_bytes`.
+    Returns a list of (base slice, point slice).
+    """
+    chunk_rows = max(1, chunk_bytes // (8 * max(1, n_features)))
+    base_step = max(1, min(n_base, chunk_rows))
+    point_step = max(1, chunk_rows // base_step)
+    return [
+        (slice(b, min(b + base_step, n_base)), slice(p, min(p + point_step, n_points)))
+        for b in range(0, n_base, base_step)
+        for p in range(0, n_points, point_step)
+    ]
+
+
+def evaluate_block(model, base_rows, columns, points, feature_names, class_index=0):
+    """
+    Score every combination of a base row and a grid point.
+
+    Returns an array of shape (len(base_rows), len(points)) holding the
+    probability of class `class_index`.
+    """
+    n_base, n_points = len(base_rows), len(points)
+    batch = np.repeat(base_rows, n_points, axis=0)
+    batch[:, columns] = np.tile(points, (n_base, 1))
+    probs = model.predict_proba(pd.DataFrame(batch, columns=feature_names, copy=False))
+    return probs[:, class_index].reshape(n_base, n_points)
+
+
+def _init_worker(model, base_rows, feature_names, class_index):
+    _WORKER_STATE.update(model=model, base_rows=base_rows,
+                         feature_names=feature_names, class_index=class_index)
+
+
+def _evaluate_task(columns, points, base_slice):
+    state = _WORKER_STATE
+    return evaluate_block(state['model'], state['base_rows'][base_slice], columns,
+                          points, state['feature_names'], state['class_index'])
+
+
+def partial_dependence(model, X, features, grid_size=50, scaler=None, base='median',
+                       pairwise=True, chunk_bytes=64 * 2 ** 20, max_workers=1, class_index=0):
+    """
+    Compute 1D and pairwise partial dependence of the predicted probability
+    on an arbitrary list of features.
+
+    Parameters:
+    model: trained sklearn classifier exposing predict_proba
+    X: pandas DataFrame in the model's input space before `scaler`
+    features: feature names to vary
+    grid_size: number of grid values per feature
+    scaler: optional StandardScaler applied to X before prediction
+    base: 'median' to vary a single median point, 'data' to vary every row
+          of X (ICE curves, averaged into partial dependence)
+    pairwise: also evaluate the 2D grid for every pair of features
+    chunk_bytes: upper bound on the size of the synthetic batch scored per
+                 predict_proba call, so wide inputs get fewer rows per call
+    max_workers: evaluate chunks in a process pool when greater than 1
+    class_index: predict_proba column to report (0 is the pass class)
+
+    Returns:
+    dict with 'grids' (feature -> values), 'ice' (feature -> n_base x grid),
+    'individual' (feature -> averaged curve) and 'pairwise'
+    ((feature_a, feature_b) -> grid x grid averaged surface)
+    """
+    feature_names = X.columns
+    if base == 'median':
+        base_frame = pd.DataFrame([X.median()], columns=feature_names)
+    elif base == 'data':
+        base_frame = X
+    else:
+        raise ValueError(f"Unknown base '{base}', expected 'median' or 'data'")
+
+    if scaler is not None:
+        base_rows = np.asarray(scaler.transform(base_frame), dtype=np.float64)
+    else:
+        base_rows = base_frame.to_numpy(dtype=np.float64)
+
+    grids = {feature: feature_grid(X, feature, grid_size) for feature in features}
+    positions = {feature: feature_names.get_loc(feature) for feature in features}
+    scaled = {feature: scale_columns(scaler, [positions[feature]], grids[feature][:, np.newaxis])
+              for feature in features}
+
+    # Every job is one grid: its varied columns and the scaled grid points
+    jobs = {(feature,): ([positions[feature]], scaled[feature]) for feature in features}
+    if pairwise:
+        for a, b in combinations(features, 2):
+            points = np.column_stack([
+                np.repeat(scaled[a][:, 0], len(grids[b])),
+                np.tile(scaled[b][:, 0], len(grids[a]))
+            ])
+            jobs[(a, b)] = ([positions[a], positions[b]], points)
+
+    n_base = len(base_rows)
+    sums = {key: np.zeros(len(points)) for key, (_, points) in jobs.items()}
+    ice = {key: np.empty((n_base, len(points))) for key, (_, points) in jobs.items() if len(key) == 1}
+
+    tasks = [
+        (key, base_slice, point_slice)
+        for key, (_, points) in jobs.items()
+        for base_slice, point_slice in plan_chunks(n_base, len(points), len(feature_names), chunk_bytes)
+    ]
+
+    def collect(key, base_slice, point_slice, block):
+        sums[key][point_slice] += block.sum(axis=0)
+        if key in ice:
+            ice[key][base_slice, point_slice] = block
+
+    if max_workers > 1:
+        with ProcessPoolExecutor(max_workers=max_workers,
+                                 initializer=_init_worker,
+                                 initargs=(model, base_rows, feature_names, class_index)) as executor:
+            futures = [
+                (key, base_slice, point_slice,
+                 executor.submit(_evaluate_task, jobs[key][0], jobs[key][1][point_slice], base_slice))
+                for key, base_slice, point_slice in tasks
+            ]
+            for key, base_slice, point_slice, future in futures:
+                collect(key, base_slice, point_slice, future.result())
+    else:
+        for key, base_slice, point_slice in tasks:
+            columns, points = jobs[key]
+            block = evaluate_block(model, base_rows[base_slice], columns, points[point_slice],
+                                   feature_names, class_index)
+            collect(key, base_slice, point_slice, block)
+
+    return {
+        'grids': grids,
+        'ice': {key[0]: values for key, values in ice.items()},
+        'individual': {key[0]: sums[key] / n_base for key in jobs if len(key) == 1},
+        'pairwise': {
+            key: (sums[key] / n_base).reshape(len(grids[key[0]]), len(grids[key[1]]))
+            for key in jobs if len(key) == 2
+        }
+    }
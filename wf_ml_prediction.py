@@ -1,44 +1,61 @@
 import warnings
 import os
 from pathlib import Path
-import pickle
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, balanced_accuracy_score, \
-    confusion_matrix
-
-
-def plot_confusion_matrix(y_true, y_pred, model_name, save_path):
-    """Create and save a confusion matrix visualization."""
-    plt.figure(figsize=(8, 6))
-    cm = confusion_matrix(y_true, y_pred)
-
-    # Create confusion matrix heatmap
-    sns.heatmap(cm, annot=True, fmt='d', cmap='Blues',
-                xticklabels=['Pass (-1)', 'Fail (1)'],
-                yticklabels=['Pass (-1)', 'Fail (1)'])
-
-    plt.title(f'Confusion Matrix - {model_name}')
-    plt.ylabel('True Label')
-    plt.xlabel('Predicted Label')
-    plt.tight_layout()
-    plt.savefig(save_path / f'{model_name.lower()}_confusion_matrix.png')
-    plt.close()
+from sklearn.ensemble import HistGradientBoostingClassifier
+from sklearn.inspection import permutation_importance
+
+from wf_metrics import evaluate_predictions, select_threshold, threshold_sweep
+from wf_model_registry import load_model, save_thresholds
+from wf_profiling import measure
+from wf_rendering import plot_spec, released_figure, render_plots
+
+
+def plot_confusion_matrix(cm, model_name, save_path):
+    """Create and save a visualization of a precomputed confusion matrix."""
+    with released_figure(figsize=(8, 6)):
+        # Create confusion matrix heatmap
+        sns.heatmap(cm, annot=True, fmt='d', cmap='Blues',
+                    xticklabels=['Pass (-1)', 'Fail (1)'],
+                    yticklabels=['Pass (-1)', 'Fail (1)'])
+
+        plt.title(f'Confusion Matrix - {model_name}')
+        plt.ylabel('True Label')
+        plt.xlabel('Predicted Label')
+        plt.tight_layout()
+        plt.savefig(save_path / f'{model_name.lower()}_confusion_matrix.png')
 
 
-def plot_feature_importance(model, feature_names, model_name, save_path):
-    """Create and save feature importance visualization."""
-    plt.figure(figsize=(10, 6))
+def model_importances(model, X=None, y=None, n_repeats=5, max_rows=500, n_jobs=None, seed=0):
+    """
+    Return absolute feature importances of a model, or None if it has none.
 
-    importances = None
+    The histogram gradient boosting engine exposes no impurity importances,
+    so given held-out `X` and `y` it gets permutation importances instead:
+    the mean drop in balanced accuracy over `n_repeats` shuffles of each
+    feature, on at most `max_rows` rows of `X` and with `n_jobs` workers.
+    This costs hundreds of predictions, so callers only pass data when asked.
+    """
     if hasattr(model, 'feature_importances_'):
-        importances = model.feature_importances_
+        return model.feature_importances_
     elif hasattr(model, 'coef_'):
-        importances = np.abs(model.coef_[0])
+        return np.abs(model.coef_[0])
+    elif isinstance(model, HistGradientBoostingClassifier) and X is not None:
+        result = permutation_importance(model, X, y, scoring='balanced_accuracy', n_repeats=n_repeats,
+                                        max_samples=min(max_rows, len(X)), n_jobs=n_jobs, random_state=seed)
+        return np.abs(result.importances_mean)
+    return None
+
 
-    if importances is not None:
+def plot_importances(importances, feature_names, model_name, save_path):
+    """Create and save a feature importance bar chart from precomputed importances."""
+    if importances is None:
+        return
+
+    with released_figure(figsize=(10, 6)):
         # Sort features by importance
         indices = np.argsort(importances)[::-1]
         top_n = 10  # Show top 10 features
@@ -51,33 +68,67 @@ def plot_feature_importance(model, feature_names, model_name, save_path):
         plt.ylabel('Importance')
         plt.tight_layout()
         plt.savefig(save_path / f'{model_name.lower()}_feature_importance.png')
-        plt.close()
+
+
+def plot_feature_importance(model, feature_names, model_name, save_path):
+    """Create and save feature importance visualization."""
+    plot_importances(model_importances(model), feature_names, model_name, save_path)
 
 
 def plot_model_comparison(results_df, save_path):
     """Create and save model comparison visualization."""
-    plt.figure(figsize=(12, 6))
+    with released_figure(figsize=(12, 6)):
+        metrics = ['balanced_accuracy', 'accuracy', 'precision', 'recall', 'f1']
+        x = np.arange(len(results_df['model_name']))
+        width = 0.15
+
+        for i, metric in enumerate(metrics):
+            plt.bar(x + i * width, results_df[metric], width, label=metric.replace('_', ' ').title())
+
+        plt.xlabel('Models')
+        plt.ylabel('Score')
+        plt.title('Model Performance Comparison')
+        plt.xticks(x + width * 2, results_df['model_name'], rotation=45)
+        plt.legend()
+        plt.tight_layout()
+        plt.savefig(save_path / 'model_comparison.png')
 
-    metrics = ['balanced_accuracy', 'accuracy', 'precision', 'recall', 'f1']
-    x = np.arange(len(results_df['model_name']))
-    width = 0.15
 
-    for i, metric in enumerate(metrics):
-        plt.bar(x + i * width, results_df[metric], width, label=metric.replace('_', ' ').title())
+def _interval(metrics, name):
+    """Format the bootstrap interval of a metric, if one was computed."""
+    if f'{name}_ci_low' not in metrics:
+        return ""
+    return f" (95% CI {metrics[f'{name}_ci_low']:.3f}-{metrics[f'{name}_ci_high']:.3f})"
 
-    plt.xlabel('Models')
-    plt.ylabel('Score')
-    plt.title('Model Performance Comparison')
-    plt.xticks(x + width * 2, results_df['model_name'], rotation=45)
-    plt.legend()
-    plt.tight_layout()
-    plt.savefig(save_path / 'model_comparison.png')
-    plt.close()
 
+FAIL_LABEL = 1
 
-def evaluate_models(X_test, y_test, base_path="models"):
+
+def evaluate_models(X_test, y_test, base_path="models", render=True, render_workers=None, n_bootstrap=1000,
+                    seed=None, cost_ratios=(1, 5, 10, 20), operating_cost_ratio=None, permutation_importances=False,
+                    n_jobs=None, validation=None):
     """
     Evaluate models with warnings suppressed and create visualizations.
+
+    Every model's predictions are stacked and scored in one pass of the
+    metrics kernel (see wf_metrics.evaluate_predictions). With `n_bootstrap`
+    > 0 the metrics also get 95% bootstrap confidence intervals.
+
+    `validation` is (labels, {model name: failure probabilities}) of data
+    the test set played no part in, e.g. out-of-fold scores of the training
+    set. Each model's validation scores are swept over every threshold (see
+    wf_metrics.threshold_sweep) at the given costs of a missed failure
+    relative to a false fail. The curves go to threshold_curves.csv and an
+    operating threshold per model (highest balanced accuracy, or lowest
+    cost at `operating_cost_ratio`) is saved to thresholds.json next to the
+    models; the test set only reports how that threshold performs. Without
+    `validation` no thresholds are chosen.
+
+    Plots are collected while the metrics are computed and rendered together
+    afterwards (see render_plots); `render=False` skips them entirely.
+    The histogram boosting engine has no fitted feature importances; with
+    `permutation_importances` it gets permutation importances on a sample of
+    the test set, computed with `n_jobs` workers (see model_importances).
     """
     # Disable parallel processing globally for scikit-learn
     os.environ["LOKY_MAX_CPU_COUNT"] = "1"
@@ -91,7 +142,10 @@ def evaluate_models(X_test, y_test, base_path="models"):
     viz_dir = evaluation_dir / "visualizations"
     viz_dir.mkdir(exist_ok=True)
 
-    results = []
+    model_names = []
+    predictions = []
+    fail_scores = {}
+    plots = []
     pos_label = -1
     summary_lines = []
 
@@ -111,56 +165,114 @@ def evaluate_models(X_test, y_test, base_path="models"):
                 continue
 
             try:
-                with open(model_path, 'rb') as f:
-                    model = pickle.load(f)
+                model = load_model(model_path)
 
                 # Ensure model's predict method doesn't use parallel processing
                 if hasattr(model, 'n_jobs'):
                     model.n_jobs = None
 
-                y_pred = model.predict(X_test)
-
-                # Calculate metrics
-                metrics = {
-                    'model_name': model_path.stem,
-                    'balanced_accuracy': balanced_accuracy_score(y_test, y_pred),
-                    'accuracy': accuracy_score(y_test, y_pred),
-                    'precision': precision_score(y_test, y_pred, pos_label=pos_label, zero_division=0),
-                    'recall': recall_score(y_test, y_pred, pos_label=pos_label, zero_division=0),
-                    'f1': f1_score(y_test, y_pred, pos_label=pos_label, zero_division=0)
-                }
+                with measure(f"predict:{model_path.stem}", 'predict'):
+                    y_pred = np.asarray(model.predict(X_test))
+                    fail_score = None
+                    if hasattr(model, 'predict_proba'):
+                        fail_index = list(model.classes_).index(FAIL_LABEL)
+                        fail_score = model.predict_proba(X_test)[:, fail_index]
+
+                # Only record a model once every step succeeded, so the rows
+                # of `predictions` stay aligned with `model_names`
+                predictions.append(y_pred)
+                model_names.append(model_path.stem)
+                if fail_score is not None:
+                    fail_scores[model_path.stem] = fail_score
+
+                if render:
+                    with measure(f"importance:{model_path.stem}", 'evaluate'):
+                        held_out = (X_test, y_test) if permutation_importances else (None, None)
+                        importances = model_importances(model, *held_out, n_jobs=n_jobs)
+                    plots.append(plot_spec(plot_importances, importances, list(X_test.columns),
+                                           model_path.stem, viz_dir))
 
-                results.append(metrics)
+            except Exception as e:
+                print(f"Error evaluating {model_path.stem}: {str(e)}")
+                continue
 
-                # Create visualizations
-                plot_confusion_matrix(y_test, y_pred, model_path.stem, viz_dir)
-                plot_feature_importance(model, X_test.columns, model_path.stem, viz_dir)
+    curves = []
+    thresholds = {}
+    if validation is None:
+        print("No validation scores given; operating thresholds are not chosen")
+    else:
+        y_val, validation_scores = validation
+        failed = np.asarray(y_test) == FAIL_LABEL
+        with measure('evaluate:thresholds', 'evaluate'):
+            for model_name, scores in fail_scores.items():
+                if model_name not in validation_scores:
+                    continue
+                sweep = threshold_sweep(y_val, validation_scores[model_name], FAIL_LABEL, cost_ratios)
+                point = select_threshold(sweep, operating_cost_ratio)
+                point['criterion'] = ('balanced_accuracy' if operating_cost_ratio is None
+                                      else f'cost_{operating_cost_ratio:g}')
+                # The sweep's first point (inf) flags nothing; the smallest
+                # float above 1 does the same and is valid JSON
+                point['threshold'] = min(point['threshold'], float(np.nextafter(1.0, 2.0)))
+                flagged = scores >= point['threshold']
+                point['test_recall'] = float((flagged & failed).sum() / failed.sum()) if failed.any() else 0.0
+                point['test_precision'] = float((flagged & failed).sum() / flagged.sum()) if flagged.any() else 0.0
+                thresholds[model_name] = point
+                curves.append(pd.DataFrame(sweep).assign(model_name=model_name))
 
-                # Add results to summary
+    results = []
+    if predictions:
+        # Score every model at once against a single pass over y_test
+        with measure('evaluate:metrics', 'evaluate'):
+            confusion, scores = evaluate_predictions(np.asarray(y_test), np.vstack(predictions), pos_label,
+                                                     n_bootstrap=n_bootstrap, seed=seed)
+
+        for i, model_name in enumerate(model_names):
+            metrics = {'model_name': model_name}
+            metrics.update({name: float(values[i]) for name, values in scores.items()})
+            results.append(metrics)
+
+            plots.append(plot_spec(plot_confusion_matrix, confusion[i], model_name, viz_dir))
+
+            # Add results to summary
+            summary_lines.extend([
+                f"MODEL: {model_name.upper()}",
+                "-" * 80,
+                "Performance Metrics:",
+                f"  Balanced Accuracy: {metrics['balanced_accuracy']:.3f}{_interval(metrics, 'balanced_accuracy')}",
+                f"    -> Model is correct {metrics['balanced_accuracy'] * 100:.1f}% of the time when accounting for class imbalance",
+                f"\n  Accuracy: {metrics['accuracy']:.3f}{_interval(metrics, 'accuracy')}",
+                f"    -> {metrics['accuracy'] * 100:.1f}% of all predictions are correct",
+                f"\n  Precision: {metrics['precision']:.3f}{_interval(metrics, 'precision')}",
+                f"    -> When model predicts 'pass', it's right {metrics['precision'] * 100:.1f}% of the time",
+                f"\n  Recall: {metrics['recall']:.3f}{_interval(metrics, 'recall')}",
+                f"    -> Model correctly identifies {metrics['recall'] * 100:.1f}% of actual passes",
+                f"\n  F1 Score: {metrics['f1']:.3f}{_interval(metrics, 'f1')}",
+                f"    -> Overall balance of precision and recall",
+            ])
+            if model_name in thresholds:
+                point = thresholds[model_name]
                 summary_lines.extend([
-                    f"MODEL: {model_path.stem.upper()}",
-                    "-" * 80,
-                    "Performance Metrics:",
-                    f"  Balanced Accuracy: {metrics['balanced_accuracy']:.3f}",
-                    f"    -> Model is correct {metrics['balanced_accuracy'] * 100:.1f}% of the time when accounting for class imbalance",
-                    f"\n  Accuracy: {metrics['accuracy']:.3f}",
-                    f"    -> {metrics['accuracy'] * 100:.1f}% of all predictions are correct",
-                    f"\n  Precision: {metrics['precision']:.3f}",
-                    f"    -> When model predicts 'pass', it's right {metrics['precision'] * 100:.1f}% of the time",
-                    f"\n  Recall: {metrics['recall']:.3f}",
-                    f"    -> Model correctly identifies {metrics['recall'] * 100:.1f}% of actual passes",
-                    f"\n  F1 Score: {metrics['f1']:.3f}",
-                    f"    -> Overall balance of precision and recall",
-                    "\n" + "=" * 80 + "\n"
+                    f"\n  Operating Threshold: {point['threshold']:.3f} "
+                    f"(by {point['criterion']} on out-of-sample training scores)",
+                    f"    -> Flags a wafer as failing when P(fail) >= {point['threshold']:.3f}; on the test set "
+                    f"it catches {point['test_recall'] * 100:.1f}% of failures, "
+                    f"{point['test_precision'] * 100:.1f}% of flags are real failures",
                 ])
+            summary_lines.append("\n" + "=" * 80 + "\n")
 
-            except Exception as e:
-                print(f"Error evaluating {model_path.stem}: {str(e)}")
-                continue
-
-    # Create model comparison plot
+    # Create model comparison plot and render everything queued
     results_df = pd.DataFrame(results)
-    plot_model_comparison(results_df, viz_dir)
+    plots.append(plot_spec(plot_model_comparison, results_df, viz_dir))
+    render_plots(plots, max_workers=render_workers, enabled=render)
+
+    # Save threshold curves and operating points
+    try:
+        if curves:
+            pd.concat(curves, ignore_index=True).to_csv(evaluation_dir / "threshold_curves.csv", index=False)
+            save_thresholds(thresholds, model_dir)
+    except Exception as e:
+        print(f"Warning: Could not save thresholds: {str(e)}")
 
     # Save summary
     try:
@@ -169,4 +281,4 @@ def evaluate_models(X_test, y_test, base_path="models"):
     except Exception as e:
         print(f"Warning: Could not save evaluation results: {str(e)}")
 
-    return results_df
\ No newline at end of file
+    return results_df
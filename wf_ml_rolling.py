@@ -0,0 +1,203 @@
+import argparse
+import os
+import sys
+import warnings
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics import accuracy_score, f1_score, precision_score, recall_score, roc_auc_score
+from sklearn.preprocessing import StandardScaler
+
+from wf_dataprocessing import (WindowClassStatistics, impute_class_conditional, read_features, read_labels,
+                               unconditional_fill_values)
+from wf_ml_training import build_models, compute_class_weight
+from wf_profiling import measure
+from wf_storage import TIME_COLUMN
+
+ROLLING_RESULTS = os.path.join('evaluation', 'rolling_results.csv')
+
+
+def read_time_ordered(labels, features):
+    """
+    Read the raw (unimputed) SECOM files with rows sorted by wafer timestamp.
+
+    Returns (timestamps, classes, values, feature names).
+    """
+    labels_df = read_labels(labels)
+    features_df = read_features(features)
+    order = np.argsort(labels_df[TIME_COLUMN].to_numpy(), kind='stable')
+    return (labels_df[TIME_COLUMN].to_numpy()[order],
+            labels_df['pass'].to_numpy()[order],
+            features_df.to_numpy()[order],
+            list(features_df.columns))
+
+
+def window_bounds(n_rows, train_size, test_size, step=None, expanding=False):
+    """
+    Yield (train_start, train_stop, test_stop) row positions of successive
+    retraining windows over time-ordered rows. Each model is tested on the
+    `test_size` rows following its training window; windows advance by
+    `step` rows (default `test_size`). Expanding windows always start at 0.
+    """
+    step = step or test_size
+    train_stop = train_size
+    while train_stop + test_size <= n_rows:
+        yield (0 if expanding else train_stop - train_size), train_stop, train_stop + test_size
+        train_stop += step
+
+
+def scaler_from_moments(moments, feature_names):
+    """
+    Build a fitted StandardScaler from pooled count/mean/M2 moments.
+
+    Like StandardScaler.fit, missing values are ignored; features with no
+    observed value in the window are passed through unchanged.
+    """
+    count = moments['count']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        var = np.where(count > 0, moments['m2'] / count, 1.0)
+    scaler = StandardScaler()
+    scaler.mean_ = np.where(count > 0, moments['mean'], 0.0)
+    scaler.var_ = var
+    # Constant features (up to rounding) keep a unit scale, with the same
+    # tolerance as StandardScaler
+    eps = np.finfo(np.float64).eps
+    constant = var <= count * eps * var + (count * scaler.mean_ * eps) ** 2
+    scaler.scale_ = np.where(constant, 1.0, np.sqrt(var))
+    scaler.n_samples_seen_ = count.astype(np.int64)
+    scaler.n_features_in_ = len(feature_names)
+    scaler.feature_names_in_ = np.asarray(feature_names, dtype=object)
+    return scaler
+
+
+def _scaled_frame(scaler, values, feature_names):
+    scaled = scaler.transform(pd.DataFrame(values, columns=feature_names, copy=False))
+    # Anything the window statistics could not fill sits at the window mean
+    return pd.DataFrame(np.nan_to_num(scaled, nan=0.0), columns=feature_names, copy=False)
+
+
+def _score(model, X_test, y_test):
+    y_pred = model.predict(X_test)
+    result = {
+        'accuracy': accuracy_score(y_test, y_pred),
+        'precision': precision_score(y_test, y_pred, pos_label=1, zero_division=0),
+        'recall': recall_score(y_test, y_pred, pos_label=1, zero_division=0),
+        'f1': f1_score(y_test, y_pred, pos_label=1, zero_division=0),
+        'roc_auc': np.nan
+    }
+    if len(np.unique(y_test)) == 2 and hasattr(model, 'predict_proba'):
+        fail_index = list(model.classes_).index(1)
+        result['roc_auc'] = roc_auc_score(y_test, model.predict_proba(X_test)[:, fail_index])
+    return result
+
+
+def rolling_retrain(train_size=800, test_size=150, step=None, expanding=False, model_names=None,
+                    boosting_engine='histogram', seed=None, n_bins=256, output=ROLLING_RESULTS,
+                    labels=os.path.join('data_original', 'secom_labels.data'),
+                    features=os.path.join('data_original', 'secom.data')):
+    """
+    Retrain the models on sliding (or expanding) windows of time-ordered
+    wafers and score each on the wafers that follow its window.
+
+    Imputation statistics and scaler moments are maintained incrementally:
+    as the window advances only the rows entering and leaving it are added
+    to or removed from the running statistics (see WindowClassStatistics).
+    Training rows are imputed class-conditionally from the window's
+    statistics; test rows, whose class is unknown at scoring time, take the
+    unconditional fill values. Histogram bins for the medians span the
+    observed range of each feature.
+
+    Parameters:
+    train_size: rows per training window (the initial size when expanding)
+    test_size: rows scored after each window
+    step: rows the window advances by (default test_size)
+    expanding: keep every earlier row instead of sliding the window
+    model_names: models to retrain per window (default all)
+    boosting_engine: gradient boosting engine, see build_boosting
+
+    Returns:
+    DataFrame with one row per window and model, also written to `output`
+    """
+    timestamps, classes, values, feature_names = read_time_ordered(labels, features)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        window_stats = WindowClassStatistics(np.nanmin(values, axis=0), np.nanmax(values, axis=0), n_bins)
+    rng = np.random.default_rng(seed)
+
+    results = []
+    start = stop = 0
+    for window, (train_start, train_stop, test_stop) in enumerate(
+            window_bounds(len(values), train_size, test_size, step, expanding)):
+        with measure(f"rolling:window_{window}:statistics", 'rolling'):
+            window_stats.add(values[stop:train_stop], classes[stop:train_stop])
+            window_stats.remove(values[start:train_start], classes[start:train_start])
+            start, stop = train_start, train_stop
+            stats = window_stats.statistics()
+            scaler = scaler_from_moments(window_stats.pooled_moments(), feature_names)
+
+        y_train = classes[train_start:train_stop]
+        y_test = classes[train_stop:test_stop]
+        if len(np.unique(y_train)) < 2:
+            print(f"Skipping window {window}: its training rows hold a single class")
+            continue
+
+        X_train = values[train_start:train_stop].copy()
+        impute_class_conditional(X_train, y_train, stats, rng)
+        X_test = values[train_stop:test_stop].copy()
+        missing = np.isnan(X_test)
+        X_test[missing] = np.broadcast_to(unconditional_fill_values(stats), X_test.shape)[missing]
+        X_train = _scaled_frame(scaler, X_train, feature_names)
+        X_test = _scaled_frame(scaler, X_test, feature_names)
+
+        models = build_models(X_train, compute_class_weight(y_train), boosting_engine=boosting_engine)
+        for model_name, model in models.items():
+            if model_names is not None and model_name not in model_names:
+                continue
+            try:
+                with measure(f"rolling:window_{window}:fit:{model_name}", 'fit'), warnings.catch_warnings():
+                    warnings.simplefilter("ignore")
+                    model.fit(X_train, y_train)
+                scores = _score(model, X_test, y_test)
+            except Exception as e:
+                print(f"Error retraining {model_name} on window {window}: {str(e)}")
+                continue
+
+            results.append({
+                'window': window,
+                'model': model_name,
+                'train_start': pd.Timestamp(timestamps[train_start]),
+                'train_end': pd.Timestamp(timestamps[train_stop - 1]),
+                'test_end': pd.Timestamp(timestamps[test_stop - 1]),
+                'train_rows': train_stop - train_start,
+                'test_rows': test_stop - train_stop,
+                'test_failures': int(np.sum(y_test == 1)),
+                **scores
+            })
+            print(f"Window {window} {model_name}: f1={scores['f1']:.3f}, roc_auc={scores['roc_auc']:.3f}")
+
+    results = pd.DataFrame(results)
+    if output is not None:
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        results.to_csv(output, index=False)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Retrain the SECOM models on rolling windows of wafers.')
+    parser.add_argument('--train-size', type=int, default=800, help='rows per training window')
+    parser.add_argument('--test-size', type=int, default=150, help='rows scored after each window')
+    parser.add_argument('--step', type=int, default=None, help='rows each window advances by')
+    parser.add_argument('--expanding', action='store_true', help='grow the window instead of sliding it')
+    parser.add_argument('--models', nargs='+', default=None, metavar='NAME', help='models to retrain')
+    parser.add_argument('--boosting-engine', default='histogram', choices=['exact', 'histogram'])
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    rolling_retrain(args.train_size, args.test_size, args.step, args.expanding, args.models,
+                    args.boosting_engine, args.seed)
+    print(f"Rolling results written to {ROLLING_RESULTS}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
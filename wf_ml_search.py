@@ -0,0 +1,273 @@
+import argparse
+import itertools
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.metrics import get_scorer
+from sklearn.model_selection import StratifiedKFold
+from sklearn.preprocessing import StandardScaler
+from threadpoolctl import threadpool_limits
+
+from wf_feature_selection import load_feature_manifest
+from wf_ml_evaluation import split_and_prepare_data
+from wf_ml_training import build_models, compute_class_weight
+from wf_model_registry import save_best_params
+from wf_profiling import PROFILER, measure, run_profiled
+from wf_storage import TIME_COLUMN, load_secom
+
+LEADERBOARD = os.path.join('evaluation', 'search_leaderboard.csv')
+
+
+def search_spaces(boosting_engine='exact'):
+    """
+    Declared search space of every model family: parameter name -> values.
+    Candidates are the full grid of each family's space.
+    """
+    if boosting_engine == 'histogram':
+        boosting = {
+            'max_iter': [150, 300],
+            'learning_rate': [0.02, 0.05, 0.1],
+            'max_depth': [3, 4, 6],
+            'min_samples_leaf': [10, 20]
+        }
+    else:
+        boosting = {
+            'n_estimators': [150, 300],
+            'learning_rate': [0.02, 0.05, 0.1],
+            'max_depth': [3, 4, 6],
+            'subsample': [0.8]
+        }
+    return {
+        'gradient_boosting': boosting,
+        'logistic_regression': {
+            'C': [0.003, 0.01, 0.03, 0.1, 0.3, 1.0]
+        },
+        'random_forest': {
+            'max_depth': [4, 8, 12, None],
+            'min_samples_leaf': [5, 10, 20],
+            'max_features': ['sqrt', 0.1]
+        },
+        'knn': {
+            'n_neighbors': [5, 10, 20, 40],
+            'metric': ['manhattan', 'euclidean']
+        }
+    }
+
+
+def grid_candidates(space):
+    names = list(space)
+    return [dict(zip(names, values)) for values in itertools.product(*space.values())]
+
+
+def stratified_order(y, rng):
+    """
+    Order rows so that every prefix holds the classes in (about) their
+    overall proportions; successive-halving budgets are then plain prefixes.
+    """
+    y = np.asarray(y)
+    keys = np.empty(len(y))
+    for value in np.unique(y):
+        rows = np.flatnonzero(y == value)
+        rows = rows[rng.permutation(len(rows))]
+        keys[rows] = (np.arange(len(rows)) + rng.random(len(rows))) / len(rows)
+    return np.argsort(keys, kind='stable')
+
+
+def prepare_folds(X, y, fold_dir, n_splits=5, seed=None):
+    """
+    Write each fold's scaled train/validation matrices to `fold_dir` once.
+
+    The scaler is fitted on each fold's training rows only. Training rows
+    are stored in stratified prefix order (see stratified_order). Workers
+    memory map the files read-only, so the folds are shared between them
+    instead of being copied into every process. Folds keep the dtype of `X`.
+
+    Returns the number of training rows per fold.
+    """
+    rng = np.random.default_rng(seed)
+    X = np.asarray(X)
+    y = np.asarray(y)
+    splitter = StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=seed)
+
+    train_sizes = []
+    for fold, (train_rows, val_rows) in enumerate(splitter.split(X, y)):
+        train_rows = train_rows[stratified_order(y[train_rows], rng)]
+        scaler = StandardScaler().fit(X[train_rows])
+        arrays = {
+            'X_train': scaler.transform(X[train_rows]),
+            'y_train': y[train_rows],
+            'X_val': scaler.transform(X[val_rows]),
+            'y_val': y[val_rows]
+        }
+        for name, values in arrays.items():
+            np.save(os.path.join(fold_dir, f"fold{fold}_{name}.npy"), values)
+        train_sizes.append(len(train_rows))
+    return train_sizes
+
+
+# Memory-mapped folds opened by this process, keyed by (fold_dir, fold)
+_FOLDS = {}
+
+
+def _fold_arrays(fold_dir, fold):
+    key = (fold_dir, fold)
+    if key not in _FOLDS:
+        _FOLDS[key] = [np.load(os.path.join(fold_dir, f"fold{fold}_{name}.npy"), mmap_mode='r')
+                       for name in ('X_train', 'y_train', 'X_val', 'y_val')]
+    return _FOLDS[key]
+
+
+def evaluate_candidate(estimator, fold_dir, fold, n_train, scoring):
+    """
+    Fit `estimator` on the first `n_train` training rows of a fold and score
+    it on the fold's validation rows. Returns (score, fit seconds); the score
+    is NaN if the candidate cannot be fitted or scored on this budget (e.g.
+    an invalid parameter combination or a single-class training slice), so
+    one bad candidate never aborts the search.
+    """
+    X_train, y_train, X_val, y_val = _fold_arrays(fold_dir, fold)
+    start = time.perf_counter()
+    try:
+        with threadpool_limits(limits=1), warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            model = clone(estimator).fit(X_train[:n_train], y_train[:n_train])
+            score = get_scorer(scoring)(model, X_val, y_val)
+    except Exception:
+        score = np.nan
+    return score, time.perf_counter() - start
+
+
+def successive_halving_rungs(n_candidates, max_resources, min_resources, eta):
+    """
+    Training-row budgets of the successive-halving rungs, smallest first.
+    The last rung always trains on every row.
+    """
+    n_rungs = math.ceil(math.log(max(n_candidates, 1), eta)) + 1
+    n_rungs = min(n_rungs, int(math.log(max_resources / min(min_resources, max_resources), eta)) + 1)
+    return [int(max_resources / eta ** (n_rungs - 1 - rung)) for rung in range(n_rungs)]
+
+
+def search_hyperparameters(X, y, models=None, boosting_engine='exact', scoring='roc_auc', n_splits=5,
+                           eta=3, min_resources=200, max_workers=None, seed=0, leaderboard=LEADERBOARD):
+    """
+    Successive-halving search over each model family's declared space.
+
+    Every candidate of a family is cross-validated on small training
+    budgets first; only the best 1/eta of them advance to the next rung,
+    which trains on eta times as many rows, until the last rung uses the
+    full training folds. Each (candidate, fold) fit is a separate task in a
+    process pool working on the shared fold matrices (see prepare_folds).
+
+    Parameters:
+    X: unscaled training features (DataFrame)
+    y: training labels
+    models: model families to tune (default all)
+    scoring: sklearn scorer name; the failure class (1) is the positive one
+
+    Returns:
+    (leaderboard DataFrame, {model: best parameters})
+    """
+    spaces = search_spaces(boosting_engine)
+    models = models or list(spaces)
+    base_models = build_models(X, compute_class_weight(y), n_jobs=1, boosting_engine=boosting_engine)
+    max_workers = max_workers or os.cpu_count() or 1
+
+    rows = []
+    best_params = {}
+    with tempfile.TemporaryDirectory() as fold_dir, \
+            ProcessPoolExecutor(max_workers=max_workers) as executor:
+        with measure('search:prepare_folds', 'search'):
+            train_sizes = prepare_folds(X, y, fold_dir, n_splits, seed)
+
+        for model_name in models:
+            candidates = grid_candidates(spaces[model_name])
+            rungs = successive_halving_rungs(len(candidates), min(train_sizes), min_resources, eta)
+            print(f"Searching {model_name}: {len(candidates)} candidates over rungs of {rungs} rows")
+
+            for rung, n_train in enumerate(rungs):
+                futures = [
+                    [executor.submit(run_profiled, evaluate_candidate, f"search:{model_name}", 'search',
+                                     clone(base_models[model_name]).set_params(**params),
+                                     fold_dir, fold, n_train, scoring)
+                     for fold in range(n_splits)]
+                    for params in candidates
+                ]
+
+                results = []
+                for params, fold_futures in zip(candidates, futures):
+                    scores = []
+                    fit_seconds = 0.0
+                    for future in fold_futures:
+                        (score, seconds), records = future.result()
+                        PROFILER.add_records(records)
+                        scores.append(score)
+                        fit_seconds += seconds
+                    with warnings.catch_warnings():
+                        warnings.simplefilter("ignore", category=RuntimeWarning)
+                        mean_score = np.nanmean(scores) if not np.all(np.isnan(scores)) else np.nan
+                        std_score = np.nanstd(scores) if not np.all(np.isnan(scores)) else np.nan
+                    results.append((params, mean_score))
+                    rows.append({
+                        'model': model_name,
+                        'params': json.dumps(params, sort_keys=True),
+                        'rung': rung,
+                        'train_rows': n_train,
+                        f'mean_{scoring}': mean_score,
+                        f'std_{scoring}': std_score,
+                        'fit_seconds': fit_seconds
+                    })
+
+                # Failed candidates rank last
+                results.sort(key=lambda result: -np.inf if np.isnan(result[1]) else result[1], reverse=True)
+                if rung < len(rungs) - 1:
+                    candidates = [params for params, _ in results[:max(1, math.ceil(len(results) / eta))]]
+
+            best_params[model_name], best_score = results[0]
+            print(f"Best {model_name}: {best_params[model_name]} ({scoring}={best_score:.3f})")
+
+    leaderboard_df = pd.DataFrame(rows)
+    final = leaderboard_df.groupby('model')['rung'].transform('max') == leaderboard_df['rung']
+    leaderboard_df = (leaderboard_df.assign(final_rung=final)
+                      .sort_values(['model', 'final_rung', f'mean_{scoring}'], ascending=[True, False, False]))
+    if leaderboard is not None:
+        os.makedirs(os.path.dirname(leaderboard), exist_ok=True)
+        leaderboard_df.to_csv(leaderboard, index=False)
+    return leaderboard_df, best_params
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Tune the SECOM models with successive halving.')
+    parser.add_argument('--models', nargs='+', default=None, metavar='NAME', help='model families to tune')
+    parser.add_argument('--boosting-engine', default='exact', choices=['exact', 'histogram'])
+    parser.add_argument('--scoring', default='roc_auc', help='sklearn scorer name (default: roc_auc)')
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--eta', type=int, default=3, help='fraction of candidates kept per rung is 1/eta')
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    # Tune on a training split only, so the held-out rows stay unseen
+    manifest = load_feature_manifest()
+    columns = ['pass', TIME_COLUMN] + manifest['kept'] if manifest is not None else None
+    split_data = split_and_prepare_data(load_secom(columns), target_column='pass', standardize=False,
+                                        random_state=args.seed)
+
+    _, best_params = search_hyperparameters(split_data['X_train'], split_data['y_train'], args.models,
+                                            args.boosting_engine, args.scoring, args.folds, args.eta,
+                                            max_workers=args.jobs, seed=args.seed)
+    save_best_params(best_params, boosting_engine=args.boosting_engine)
+    print(f"Leaderboard written to {LEADERBOARD}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
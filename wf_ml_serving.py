@@ -0,0 +1,229 @@
+import pickle
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from wf_dataprocessing import load_imputation_stats, unconditional_fill_values
+from wf_feature_selection import load_feature_manifest
+from wf_model_registry import load_model, load_thresholds
+from wf_storage import FEATURE_MANIFEST, IMPUTATION_STATS
+
+N_FEATURES = 590
+PASS_LABEL = -1
+FAIL_LABEL = 1
+
+
+class WaferScorer:
+    """
+    Score raw wafers with the persisted scaler and models.
+
+    The scaler, models and imputation statistics are loaded once. Raw rows
+    have their missing values filled, are projected onto the features kept
+    by feature selection and are scaled exactly as in training before being
+    passed to `predict_proba`.
+
+    Parameters:
+    model_dir: directory holding the pickled models
+    scaler_path: pickled StandardScaler written by store_split_data
+    stats_path: imputation statistics written by mung_data
+    manifest_path: feature manifest written by select_data
+    model_names: models to load (defaults to every .pkl in model_dir)
+    """
+
+    def __init__(self, model_dir="models", scaler_path="data_processed/scaler.pkl",
+                 stats_path=IMPUTATION_STATS, manifest_path=FEATURE_MANIFEST, model_names=None):
+        model_dir = Path(model_dir)
+        if model_names is None:
+            model_names = [path.stem for path in sorted(model_dir.glob("*.pkl")) if path.stem != 'scaler']
+
+        with open(scaler_path, 'rb') as f:
+            self.scaler = pickle.load(f)
+
+        self.models = {name: load_model(model_dir / f"{name}.pkl") for name in model_names}
+        # Operating thresholds on P(fail) picked by evaluate_models
+        self.thresholds = {name: point['threshold'] for name, point in load_thresholds(model_dir).items()}
+        all_features = [f'feature_{i}' for i in range(N_FEATURES)]
+        self.feature_names = list(getattr(self.scaler, 'feature_names_in_', all_features))
+
+        manifest = load_feature_manifest(manifest_path)
+        if manifest is not None and manifest['kept'] != self.feature_names:
+            raise ValueError(f"Feature manifest {manifest_path} does not match the features the scaler was fit on")
+        # Raw rows always carry every sensor; models only see the kept ones
+        self.columns = np.array([all_features.index(name) for name in self.feature_names])
+
+        # The class of a wafer is unknown at scoring time, so missing values
+        # take the class-size weighted median instead of a class-conditional draw
+        self.fill_values = unconditional_fill_values(load_imputation_stats(stats_path))
+
+    def prepare(self, rows):
+        """
+        Fill missing values and scale raw rows of all 590 features.
+        """
+        values = np.array(rows, dtype=np.float64, ndmin=2)
+        if values.shape[1] != len(self.fill_values):
+            raise ValueError(f"Expected {len(self.fill_values)} features per wafer, got {values.shape[1]}")
+
+        missing = np.isnan(values)
+        if missing.any():
+            values[missing] = np.broadcast_to(self.fill_values, values.shape)[missing]
+        if len(self.columns) != values.shape[1]:
+            values = values[:, self.columns]
+
+        scaled = self.scaler.transform(pd.DataFrame(values, columns=self.feature_names, copy=False))
+        return pd.DataFrame(scaled, columns=self.feature_names, copy=False)
+
+    def predict_proba(self, rows, model_name='gradient_boosting'):
+        """
+        Return the pass probability of each raw row for one model.
+        """
+        return self._pass_probability(self.models[model_name], self.prepare(rows))
+
+    def predict_all(self, rows):
+        """
+        Return {model name: pass probabilities} for every loaded model.
+        """
+        prepared = self.prepare(rows)
+        return {name: self._pass_probability(model, prepared) for name, model in self.models.items()}
+
+    def flag_failures(self, rows, model_name='gradient_boosting'):
+        """
+        Return True for raw rows whose failure probability reaches the model's
+        persisted operating threshold (0.5 if none was saved).
+        """
+        model = self.models[model_name]
+        fail_index = list(model.classes_).index(FAIL_LABEL)
+        fail_probability = model.predict_proba(self.prepare(rows))[:, fail_index]
+        return fail_probability >= self.thresholds.get(model_name, 0.5)
+
+    @staticmethod
+    def _pass_probability(model, prepared):
+        pass_index = list(model.classes_).index(PASS_LABEL)
+        return model.predict_proba(prepared)[:, pass_index]
+
+
+class MicroBatcher:
+    """
+    Coalesce concurrent single-wafer requests into vectorized predictions.
+
+    A background thread collects submitted rows until `max_batch_size` rows
+    are waiting or the oldest request has waited `max_latency` seconds, then
+    scores the whole batch with one `predict_proba` call.
+
+    Usage:
+    with MicroBatcher(WaferScorer()) as batcher:
+        probability = batcher.score(raw_row)
+    """
+
+    def __init__(self, scorer, model_name='gradient_boosting', max_batch_size=256, max_latency=0.005):
+        self.scorer = scorer
+        self.model_name = model_name
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self._requests = queue.Queue()
+        self._stop = object()
+        self._thread = None
+        # Held while checking the batcher is running and queueing behind that
+        # check, so no request can be queued after the stop marker
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='wafer-micro-batcher', daemon=True)
+                self._thread.start()
+        return self
+
+    def close(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is None:
+                return
+            self._requests.put(self._stop)
+        thread.join()
+
+        # Anything still queued would never be scored; fail it instead
+        while not self._requests.empty():
+            item = self._requests.get_nowait()
+            if item is not self._stop and item[1].set_running_or_notify_cancel():
+                item[1].set_exception(RuntimeError("MicroBatcher was closed before the request was scored"))
+
+    def submit(self, row):
+        """
+        Queue one raw wafer; returns a Future resolving to its pass probability.
+        """
+        row = np.asarray(row, dtype=np.float64)
+        if row.shape != (len(self.scorer.fill_values),):
+            raise ValueError(f"Expected a single wafer of {len(self.scorer.fill_values)} features, "
+                             f"got shape {row.shape}")
+        future = Future()
+        with self._lock:
+            if self._thread is None:
+                raise RuntimeError("MicroBatcher is not running; call start() first")
+            self._requests.put((row, future))
+        return future
+
+    def score(self, row, timeout=None):
+        return self.submit(row).result(timeout)
+
+    def _collect(self):
+        first = self._requests.get()
+        if first is self._stop:
+            return None, True
+
+        batch = [first]
+        deadline = time.monotonic() + self.max_latency
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is self._stop:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._collect()
+            if batch:
+                self._score_batch(batch)
+
+        # Drain anything submitted before close()
+        pending = []
+        while not self._requests.empty():
+            item = self._requests.get_nowait()
+            if item is not self._stop:
+                pending.append(item)
+        for start in range(0, len(pending), self.max_batch_size):
+            self._score_batch(pending[start:start + self.max_batch_size])
+
+    def _score_batch(self, batch):
+        # Skip requests that were cancelled while queued
+        batch = [(row, future) for row, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        rows = [row for row, _ in batch]
+        futures = [future for _, future in batch]
+        try:
+            probabilities = self.scorer.predict_proba(np.vstack(rows), self.model_name)
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+        for future, probability in zip(futures, probabilities):
+            future.set_result(float(probability))
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -1,16 +1,29 @@
+import os
+import time
 import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 import pickle
 import numpy as np
 import pandas as pd
-from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
+from sklearn.ensemble import GradientBoostingClassifier, HistGradientBoostingClassifier, RandomForestClassifier
 from sklearn.linear_model import LogisticRegression
 from sklearn.neighbors import KNeighborsClassifier
+from threadpoolctl import threadpool_limits
+
+from wf_knn import BlockedKNeighborsClassifier
+from wf_model_registry import (hash_training_data, load_model, model_cache_key, read_cache_index,
+                               register_model, write_cache_index)
+from wf_profiling import PROFILER, measure, run_profiled
 
 
 def get_feature_importance(model, feature_names):
     """
     Get feature importance from the model if available.
+
+    The histogram boosting engine has no fitted importances and gets None
+    here; evaluate_models can compute permutation importances for it on the
+    test set.
     """
     try:
         if hasattr(model, 'feature_importances_'):
@@ -25,40 +38,101 @@ def get_feature_importance(model, feature_names):
         return None
 
 
-def train_classification_models(X_train, y_train, base_path="models"):
+def compute_class_weight(y_train):
     """
-    Train multiple classification models with parallel processing completely disabled.
+    Balanced class weights with an extra 20% weight on failed wafers.
     """
     n_samples = len(y_train)
-    n_passed = sum(y_train == -1)
-    n_failed = sum(y_train == 1)
+    n_passed = int(np.sum(y_train == -1))
+    n_failed = int(np.sum(y_train == 1))
 
     weight_for_passed = (1 / n_passed) * (n_samples / 2)
     weight_for_failed = (1 / n_failed) * (n_samples / 2) * 1.2
-    class_weight = {-1: weight_for_passed, 1: weight_for_failed}
+    return {-1: weight_for_passed, 1: weight_for_failed}
 
-    print(f"Class distribution - Passed (-1): {n_passed}, Failed (1): {n_failed}")
-    print(f"Class weights - Passed: {weight_for_passed:.2f}, Failed: {weight_for_failed:.2f}")
 
-    model_dir = Path(base_path)
-    model_dir.mkdir(parents=True, exist_ok=True)
+KNN_BACKENDS = ('sklearn', 'blocked', 'pca')
+BOOSTING_ENGINES = ('exact', 'histogram')
+
 
-    # Models with ALL parallel processing disabled
-    models = {
-        'gradient_boosting': GradientBoostingClassifier(
+def build_boosting(class_weight, engine='exact'):
+    """
+    Build the gradient boosting estimator for the given engine.
+
+    'exact' is the single-threaded GradientBoostingClassifier. 'histogram'
+    bins the features and fits with HistGradientBoostingClassifier, which
+    uses OpenMP threads (capped by fit_and_store_model's threadpool limit)
+    and weighs the classes with `class_weight`.
+    """
+    if engine == 'exact':
+        return GradientBoostingClassifier(
             n_estimators=300,
             learning_rate=0.05,
             max_depth=4,
             min_samples_leaf=10,
             subsample=0.8,
-            # GradientBoosting doesn't use parallel processing by default
-        ),
+            # GradientBoosting has no intra-model parallelism
+        )
+    if engine == 'histogram':
+        # This estimator looks class weights up by the label-encoded class
+        # (0, 1, ...) rather than the original label, so the encoded keys are
+        # added; for -1/1 labels both key sets give each class the same weight
+        encoded = {i: class_weight[label] for i, label in enumerate(sorted(class_weight))}
+        return HistGradientBoostingClassifier(
+            max_iter=300,
+            learning_rate=0.05,
+            max_depth=4,
+            min_samples_leaf=10,
+            class_weight={**class_weight, **encoded},
+            early_stopping=False,  # always fit all 300 iterations, as the exact engine does
+            random_state=0
+        )
+    raise ValueError(f"Unknown boosting engine '{engine}'. Available: {', '.join(BOOSTING_ENGINES)}")
+
+
+def build_knn(X_train, n_jobs=None, backend='sklearn', n_components=64):
+    """
+    Build the KNN estimator for the given backend.
+
+    'sklearn' uses KNeighborsClassifier; 'blocked' keeps a float32 index
+    searched with a bounded-memory L1 kernel; 'pca' does the same on the
+    first `n_components` principal components.
+    """
+    n_neighbors = min(int(np.sqrt(len(X_train))), 20)
+    if backend == 'sklearn':
+        return KNeighborsClassifier(
+            n_neighbors=n_neighbors,
+            weights='distance',
+            metric='manhattan',
+            n_jobs=n_jobs,
+            algorithm='auto'
+        )
+    if backend in ('blocked', 'pca'):
+        return BlockedKNeighborsClassifier(
+            n_neighbors=n_neighbors,
+            weights='distance',
+            metric='manhattan',
+            n_components=n_components if backend == 'pca' else None
+        )
+    raise ValueError(f"Unknown KNN backend '{backend}'. Available: {', '.join(KNN_BACKENDS)}")
+
+
+def build_models(X_train, class_weight, n_jobs=None, knn_backend='sklearn', boosting_engine='exact'):
+    """
+    Build the unfitted estimators keyed by model name.
+
+    `n_jobs` is handed to the estimators that support intra-model parallelism.
+    `knn_backend` selects the KNN implementation (see build_knn) and
+    `boosting_engine` the gradient boosting one (see build_boosting).
+    """
+    return {
+        'gradient_boosting': build_boosting(class_weight, boosting_engine),
         'logistic_regression': LogisticRegression(
             max_iter=2000,
             class_weight=class_weight,
             C=0.1,
-            n_jobs=None,  # Changed from 1 to None to disable parallel processing
-            solver='liblinear'  # Using liblinear solver which doesn't use joblib
+            n_jobs=None,  # liblinear is single threaded and ignores n_jobs
+            solver='liblinear'
         ),
         'random_forest': RandomForestClassifier(
             n_estimators=200,
@@ -66,47 +140,185 @@ def train_classification_models(X_train, y_train, base_path="models"):
             min_samples_leaf=10,
             max_features='sqrt',
             class_weight=class_weight,
-            n_jobs=None,  # Changed from 1 to None to disable parallel processing
+            n_jobs=n_jobs,
             bootstrap=True
         ),
-        'knn': KNeighborsClassifier(
-            n_neighbors=min(int(np.sqrt(len(X_train))), 20),
-            weights='distance',
-            metric='manhattan',
-            n_jobs=None,  # Changed from 1 to None to disable parallel processing
-            algorithm='auto'
-        )
+        'knn': build_knn(X_train, n_jobs, knn_backend)
     }
 
-    model_info = {}
 
+def fits_in_parallel(model):
+    """
+    Whether fitting `model` uses more than one thread: random forests
+    (n_jobs) and the histogram boosting engine (OpenMP) do; liblinear, the
+    exact boosting engine and KNN (which only stores its index) do not.
+    """
+    return isinstance(model, (RandomForestClassifier, HistGradientBoostingClassifier))
+
+
+def thread_allocation(models, n_cores, max_workers):
+    """
+    Threads for each of the {name: model} fits sharing `n_cores` cores with
+    at most `max_workers` running at once. Single-threaded fits get one core
+    each; the remaining cores are split between the fits that use them.
+    """
+    parallel = [name for name, model in models.items() if fits_in_parallel(model)]
+    n_parallel = min(len(parallel), max_workers)
+    n_serial = min(len(models) - len(parallel), max_workers - n_parallel)
+    share = max(1, (n_cores - n_serial) // max(n_parallel, 1))
+    return {name: share if name in parallel else 1 for name in models}
+
+
+def fit_and_store_model(model_name, model, X_train, y_train, model_path, n_threads=1):
+    """
+    Fit a single model, pickle it to `model_path` and return its info entry.
+
+    Runs either in-process or inside a worker of the training pool; native
+    thread pools (BLAS/OpenMP) are capped at `n_threads` so concurrent fits
+    stay within the core budget.
+    """
+    print(f"\nTraining {model_name}...")
+    start = time.perf_counter()
+    with measure(f"fit:{model_name}", 'fit'), threadpool_limits(limits=n_threads), warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        model.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - start
+
+    with open(model_path, 'wb') as f:
+        pickle.dump(model, f)
+
+    print(f"Completed training {model_name} in {fit_seconds:.2f}s")
+    return describe_model(model, model_path, X_train.columns, fit_seconds)
+
+
+def describe_model(model, model_path, feature_names, fit_seconds=None, cached=False):
+    """
+    Build the model_info entry for a fitted model.
+    """
+    return {
+        'path': str(model_path),
+        'type': type(model).__name__,
+        'parameters': {
+            k: str(v) if isinstance(v, (np.ndarray, list)) else v
+            for k, v in model.get_params().items()
+        },
+        'feature_importance': get_feature_importance(model, feature_names),
+        'fit_seconds': fit_seconds,
+        'cached': cached
+    }
+
+
+def train_classification_models(X_train, y_train, base_path="models", max_workers=None, n_cores=None,
+                                use_cache=True, knn_backend='sklearn', boosting_engine='exact',
+                                param_overrides=None):
+    """
+    Train multiple classification models, fitting independent models
+    concurrently in a process pool.
+
+    `n_cores` is the global core budget (defaults to all cores). Of the
+    `max_workers` concurrent fits, single-threaded ones get one core each and
+    the rest of the budget is split between the multithreaded ones (see
+    thread_allocation), as their `n_jobs` and native thread limit.
+    `max_workers=1` trains the models one after another in the current
+    process.
+
+    A model is only refit when the hash of the training data, labels and its
+    parameters differs from the one recorded in model_cache.json (or when
+    `use_cache` is False).
+
+    `knn_backend='blocked'` (or 'pca') swaps in the float32 blocked KNN,
+    whose prediction cost stays bounded in memory for large wafer histories.
+    `boosting_engine='histogram'` fits gradient_boosting with the binned,
+    multithreaded engine; it is still stored as gradient_boosting.pkl.
+    `param_overrides` ({model name: parameters}, e.g. from load_best_params)
+    replace the default hyperparameters.
+    """
+    class_weight = compute_class_weight(y_train)
+
+    print(f"Class distribution - Passed (-1): {sum(y_train == -1)}, Failed (1): {sum(y_train == 1)}")
+    print(f"Class weights - Passed: {class_weight[-1]:.2f}, Failed: {class_weight[1]:.2f}")
+
+    model_dir = Path(base_path)
+    model_dir.mkdir(parents=True, exist_ok=True)
+
+    n_cores = n_cores or os.cpu_count() or 1
+    n_models = len(build_models(X_train, class_weight, knn_backend=knn_backend,
+                                boosting_engine=boosting_engine))
+    max_workers = max(1, min(max_workers or n_models, n_models, n_cores))
+
+    models = build_models(X_train, class_weight, knn_backend=knn_backend, boosting_engine=boosting_engine)
+    for model_name, params in (param_overrides or {}).items():
+        if model_name in models:
+            models[model_name].set_params(**params)
+
+    # Reuse persisted models whose data/parameter key is unchanged
+    data_hash = hash_training_data(X_train, y_train)
+    cache_index = read_cache_index(model_dir)
+    cache_keys = {name: model_cache_key(data_hash, model) for name, model in models.items()}
+
+    results = {}
+    pending = {}
     for model_name, model in models.items():
-        try:
-            print(f"\nTraining {model_name}...")
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                model.fit(X_train, y_train)
-
-            model_path = model_dir / f"{model_name}.pkl"
-            with open(model_path, 'wb') as f:
-                pickle.dump(model, f)
-
-            # Store model info
-            feature_importance = get_feature_importance(model, X_train.columns)
-            model_info[model_name] = {
-                'path': str(model_path),
-                'type': type(model).__name__,
-                'parameters': {
-                    k: str(v) if isinstance(v, (np.ndarray, list)) else v
-                    for k, v in model.get_params().items()
-                },
-                'feature_importance': feature_importance
+        model_path = model_dir / f"{model_name}.pkl"
+        if use_cache and cache_index.get(model_name) == cache_keys[model_name] and model_path.exists():
+            try:
+                cached_model = load_model(model_path)
+                results[model_name] = describe_model(cached_model, model_path, X_train.columns, cached=True)
+                print(f"Using cached {model_name}")
+                continue
+            except Exception as e:
+                print(f"Could not load cached {model_name}, retraining: {str(e)}")
+        pending[model_name] = model
+
+    max_workers = max(1, min(max_workers, len(pending) or 1))
+    threads = thread_allocation(pending, n_cores, max_workers)
+    for model_name, model in pending.items():
+        if 'n_jobs' in model.get_params() and fits_in_parallel(model):
+            model.set_params(n_jobs=threads[model_name])
+    if pending:
+        print(f"Training {len(pending)} models with {max_workers} worker(s); threads: "
+              + ', '.join(f"{name} {threads[name]}" for name in pending))
+
+    if max_workers == 1:
+        for model_name, model in pending.items():
+            try:
+                model_path = model_dir / f"{model_name}.pkl"
+                results[model_name] = fit_and_store_model(
+                    model_name, model, X_train, y_train, model_path, threads[model_name]
+                )
+                register_model(model_path, model)
+                cache_index[model_name] = cache_keys[model_name]
+            except Exception as e:
+                print(f"Error training {model_name}: {str(e)}")
+                cache_index.pop(model_name, None)
+                continue
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(
+                    run_profiled, fit_and_store_model, f"train:{model_name}", 'train',
+                    model_name, model, X_train, y_train, model_dir / f"{model_name}.pkl", threads[model_name]
+                ): model_name
+                for model_name, model in pending.items()
             }
-            print(f"Completed training {model_name}")
+            for future in as_completed(futures):
+                model_name = futures[future]
+                try:
+                    results[model_name], records = future.result()
+                    PROFILER.add_records(records)
+                    cache_index[model_name] = cache_keys[model_name]
+                except Exception as e:
+                    print(f"Error training {model_name}: {str(e)}")
+                    cache_index.pop(model_name, None)
+                    continue
+
+    try:
+        write_cache_index(model_dir, cache_index)
+    except Exception as e:
+        print(f"Warning: Could not save model cache index: {str(e)}")
 
-        except Exception as e:
-            print(f"Error training {model_name}: {str(e)}")
-            continue
+    # Keep the declaration order regardless of completion order
+    model_info = {name: results[name] for name in models if name in results}
 
     try:
         info_path = model_dir / "model_info.json"
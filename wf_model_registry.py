@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import pickle
+from pathlib import Path
+
+import numpy as np
+
+# In-process registry of loaded estimators, keyed by resolved model path.
+# Entries are invalidated when the file on disk changes.
+_REGISTRY = {}
+
+CACHE_INDEX = "model_cache.json"
+THRESHOLDS_FILE = "thresholds.json"
+BEST_PARAMS_FILE = "best_params.json"
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def register_model(path, model):
+    """
+    Record an estimator that was just written to `path` so later lookups
+    don't have to unpickle it again.
+    """
+    path = Path(path).resolve()
+    _REGISTRY[path] = (_file_signature(path), model)
+    return model
+
+
+def load_model(path):
+    """
+    Return the estimator stored at `path`, unpickling it only on first use
+    or when the file has changed since it was loaded.
+    """
+    path = Path(path).resolve()
+    signature = _file_signature(path)
+    cached = _REGISTRY.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    with open(path, 'rb') as f:
+        model = pickle.load(f)
+    _REGISTRY[path] = (signature, model)
+    return model
+
+
+def clear_registry():
+    _REGISTRY.clear()
+
+
+def hash_training_data(X, y):
+    """
+    Content hash of a training matrix, its column names and the labels.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([str(c) for c in X.columns]).encode('utf-8'))
+    values = np.ascontiguousarray(X.to_numpy())
+    digest.update(str(values.dtype).encode('utf-8'))
+    digest.update(str(values.shape).encode('utf-8'))
+    digest.update(values.data)
+    digest.update(np.ascontiguousarray(np.asarray(y)).data)
+    return digest.hexdigest()
+
+
+def model_cache_key(data_hash, model):
+    """
+    Cache key for fitting `model` on the data identified by `data_hash`.
+
+    Parameters that only affect how the fit is scheduled (n_jobs) are not
+    part of the key.
+    """
+    params = {k: repr(v) for k, v in model.get_params().items() if k != 'n_jobs'}
+    payload = json.dumps({'data': data_hash, 'type': type(model).__name__, 'params': params},
+                         sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def read_cache_index(model_dir):
+    index_path = Path(model_dir) / CACHE_INDEX
+    if not index_path.exists():
+        return {}
+    try:
+        with open(index_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_cache_index(model_dir, index):
+    with open(Path(model_dir) / CACHE_INDEX, 'w') as f:
+        json.dump(index, f, indent=2)
+
+
+def save_thresholds(thresholds, model_dir="models"):
+    with open(Path(model_dir) / THRESHOLDS_FILE, 'w') as f:
+        # Reject inf/NaN, which would be written as non-standard JSON
+        json.dump(thresholds, f, indent=2, allow_nan=False)
+
+
+def load_thresholds(model_dir="models"):
+    """
+    Return the persisted operating thresholds keyed by model name ({} if none).
+    """
+    path = Path(model_dir) / THRESHOLDS_FILE
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_best_params(best_params, boosting_engine='exact', model_dir="models"):
+    """
+    Persist tuned parameters per model; the boosting engine they were tuned
+    for is recorded since the two engines take different parameters.
+
+    Families not in `best_params` keep the parameters stored by earlier
+    searches (and gradient_boosting keeps its engine).
+    """
+    path = Path(model_dir) / BEST_PARAMS_FILE
+    stored = {'boosting_engine': boosting_engine, 'params': {}}
+    if path.exists():
+        with open(path) as f:
+            stored = json.load(f)
+    params = {**stored['params'], **best_params}
+    if 'gradient_boosting' in best_params or 'gradient_boosting' not in stored['params']:
+        stored['boosting_engine'] = boosting_engine
+
+    Path(model_dir).mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'boosting_engine': stored.get('boosting_engine', 'exact'), 'params': params}, f, indent=2)
+
+
+def load_best_params(boosting_engine='exact', model_dir="models"):
+    """
+    Return the tuned parameters keyed by model name ({} if no search has
+    been run). Boosting parameters tuned for another engine are left out.
+    """
+    path = Path(model_dir) / BEST_PARAMS_FILE
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        stored = json.load(f)
+    params = dict(stored['params'])
+    if stored.get('boosting_engine', 'exact') != boosting_engine:
+        params.pop('gradient_boosting', None)
+    return params
@@ -0,0 +1,358 @@
+import ast
+import hashlib
+import json
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import partial
+
+from wf_dataprocessing import IMPUTATION_SEED, mung_data
+from wf_feature_selection import select_data
+from wf_ml_evaluation import SPLIT_SEED, evaluate_data
+from wf_profiling import PROFILER, measure, run_profiled
+from wf_storage import FEATURE_MANIFEST, IMPUTATION_STATS, SECOM_OUTPUT
+from wf_visualization import visualize_data
+
+STATE_FILE = os.path.join('data_processed', 'pipeline_state.json')
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def module_sources(*modules):
+    """
+    Source files of `modules` and of every wf_* module they import, directly
+    or transitively, so a stage reruns when any code it executes changes.
+    """
+    seen = set()
+    pending = list(modules)
+    while pending:
+        name = pending.pop()
+        path = os.path.join(SOURCE_DIR, f'{name}.py')
+        if name in seen or not os.path.exists(path):
+            continue
+        seen.add(name)
+        with open(path) as f:
+            tree = ast.parse(f.read(), filename=path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                pending.extend(alias.name for alias in node.names if alias.name.startswith('wf_'))
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and (node.module or '').startswith('wf_'):
+                pending.append(node.module)
+    return sorted(f'{name}.py' for name in seen)
+
+
+# A pipeline stage: a picklable callable, the files/directories it reads
+# (source modules included via module_sources, so code changes trigger a
+# rerun), the files it writes, the stages that must run before it and the
+# keyword arguments the callable is run with (changing them also triggers a
+# rerun).
+Stage = namedtuple('Stage', ['name', 'func', 'inputs', 'outputs', 'deps', 'params'], defaults=[None])
+
+STAGES = [
+    Stage(
+        name='mung',
+        func=mung_data,
+        params={'seed': IMPUTATION_SEED},
+        inputs=[os.path.join('data_original', 'secom.data'),
+                os.path.join('data_original', 'secom_labels.data')] + module_sources('wf_dataprocessing'),
+        outputs=[SECOM_OUTPUT, IMPUTATION_STATS],
+        deps=[]
+    ),
+    Stage(
+        name='visualize',
+        func=visualize_data,
+        inputs=[SECOM_OUTPUT, IMPUTATION_STATS] + module_sources('wf_visualization'),
+        outputs=[os.path.join('data_processed', 'summary.txt'),
+                 os.path.join('data_processed', 'feature_statistics.csv'),
+                 os.path.join('data_processed', 'correlations.txt')],
+        deps=['mung']
+    ),
+    Stage(
+        name='select',
+        func=select_data,
+        inputs=[SECOM_OUTPUT, IMPUTATION_STATS] + module_sources('wf_feature_selection'),
+        outputs=[FEATURE_MANIFEST],
+        deps=['mung']
+    ),
+    Stage(
+        name='evaluate',
+        func=partial(evaluate_data, True),
+        params={'random_state': SPLIT_SEED, 'prune_features': True, 'knn_backend': 'sklearn'},
+        inputs=[SECOM_OUTPUT, FEATURE_MANIFEST] + module_sources('wf_ml_evaluation'),
+        outputs=[os.path.join('data_processed', 'split_metadata.json'),
+                 os.path.join('models', 'model_info.json'),
+                 os.path.join('evaluation', 'summary.txt')],
+        deps=['select']
+    ),
+]
+
+
+class Fingerprinter:
+    """
+    Content hashes of files and directories, memoized on (mtime, size) so
+    unchanged files are not re-read between runs.
+    """
+
+    def __init__(self, cache=None):
+        self.cache = dict(cache or {})
+
+    def file_hash(self, path):
+        stat = os.stat(path)
+        signature = [stat.st_mtime_ns, stat.st_size]
+        cached = self.cache.get(path)
+        if cached is not None and cached['signature'] == signature:
+            return cached['hash']
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        self.cache[path] = {'signature': signature, 'hash': digest.hexdigest()}
+        return self.cache[path]['hash']
+
+    def fingerprint(self, path):
+        if os.path.isdir(path):
+            digest = hashlib.sha256()
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    file_path = os.path.join(root, name)
+                    digest.update(os.path.relpath(file_path, path).encode('utf-8'))
+                    digest.update(self.file_hash(file_path).encode('utf-8'))
+            return digest.hexdigest()
+        if os.path.exists(path):
+            return self.file_hash(path)
+        return None
+
+    def fingerprints(self, paths):
+        return {path: self.fingerprint(path) for path in paths}
+
+
+def load_state(path=STATE_FILE):
+    if not os.path.exists(path):
+        return {'stages': {}, 'files': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(state, path=STATE_FILE):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(state, f, indent=2)
+
+
+def stage_map(stages=STAGES):
+    return {stage.name: stage for stage in stages}
+
+
+def select_stages(targets=None, stages=STAGES):
+    """
+    Return the requested stages plus everything upstream of them, in
+    dependency order.
+    """
+    by_name = stage_map(stages)
+    targets = list(targets or by_name)
+    unknown = [name for name in targets if name not in by_name]
+    if unknown:
+        raise ValueError(f"Unknown stage(s): {', '.join(unknown)}. Available: {', '.join(by_name)}")
+
+    selected = set()
+    pending = list(targets)
+    while pending:
+        name = pending.pop()
+        if name not in selected:
+            selected.add(name)
+            pending.extend(by_name[name].deps)
+    return [stage for stage in stages if stage.name in selected]
+
+
+def configure_stages(params, stages=STAGES):
+    """
+    Return `stages` with the keyword arguments in {stage name: params} added
+    to the named stages.
+    """
+    unknown = [name for name in params if name not in stage_map(stages)]
+    if unknown:
+        raise ValueError(f"Unknown stage(s): {', '.join(unknown)}")
+    return [stage._replace(params={**(stage.params or {}), **params[stage.name]}) if stage.name in params else stage
+            for stage in stages]
+
+
+def stale_reason(stage, state, fingerprinter):
+    """
+    Why `stage` has to run, or None if it is up to date.
+    """
+    record = state['stages'].get(stage.name)
+    if record is None:
+        return 'never run'
+    if any(not os.path.exists(path) for path in stage.outputs):
+        return 'missing outputs'
+    if record.get('params', {}) != (stage.params or {}):
+        return 'changed parameters'
+    current = fingerprinter.fingerprints(stage.inputs)
+    changed = [path for path, value in current.items() if record['inputs'].get(path) != value]
+    if changed:
+        return 'changed: ' + ', '.join(changed)
+    return None
+
+
+def plan(targets=None, force=False, stages=STAGES, state_path=STATE_FILE):
+    """
+    Decide which stages would run. A stage downstream of one that runs is
+    assumed to run as well, since its inputs will be rewritten. `force`
+    applies to `targets` only (every stage when no targets are given), not
+    to the upstream stages pulled in for them.
+
+    Returns a list of (stage name, reason or None) in dependency order.
+    """
+    state = load_state(state_path)
+    fingerprinter = Fingerprinter(state['files'])
+    forced = _forced_stages(targets, force, stages)
+    running = set()
+    result = []
+    for stage in select_stages(targets, stages):
+        if stage.name in forced:
+            reason = 'forced'
+        elif any(dep in running for dep in stage.deps):
+            reason = 'upstream stage runs'
+        else:
+            reason = stale_reason(stage, state, fingerprinter)
+        if reason is not None:
+            running.add(stage.name)
+        result.append((stage.name, reason))
+    return result
+
+
+def _forced_stages(targets, force, stages):
+    if not force:
+        return set()
+    return set(targets or stage_map(stages))
+
+
+def _modified_since(path, start):
+    """
+    Whether `path` (or, for a directory, any file below it) was written at or
+    after `start`, a time.time() value truncated to whole seconds so coarse
+    file system timestamps still compare correctly.
+    """
+    if os.path.isdir(path):
+        return any(_modified_since(os.path.join(root, name), start)
+                   for root, _, files in os.walk(path) for name in files)
+    return os.path.getmtime(path) >= int(start)
+
+
+def _check_acyclic(stages):
+    """
+    Raise if the dependencies among `stages` form a cycle.
+    """
+    done = set()
+    names = {stage.name for stage in stages}
+    remaining = list(stages)
+    while remaining:
+        ready = [stage for stage in remaining if all(dep in done or dep not in names for dep in stage.deps)]
+        if not ready:
+            raise ValueError("Pipeline stages have a dependency cycle")
+        done.update(stage.name for stage in ready)
+        remaining = [stage for stage in remaining if stage not in ready]
+
+
+def run(targets=None, force=False, max_workers=None, stages=STAGES, state_path=STATE_FILE):
+    """
+    Run the stale stages among `targets` (all stages by default) and their
+    upstream stages. Each stage is started as soon as the stages it depends
+    on have finished, so independent branches of the graph run concurrently
+    in separate processes; `max_workers=1` runs them one after another in
+    the current process. As in plan, `force` reruns only `targets`.
+
+    Returns {stage name: 'ran' | 'up to date' | 'failed'}.
+    """
+    state = load_state(state_path)
+    fingerprinter = Fingerprinter(state['files'])
+    forced = _forced_stages(targets, force, stages)
+    outcome = {}
+
+    selected = select_stages(targets, stages)
+    _check_acyclic(selected)
+    names = {stage.name for stage in selected}
+    pending = list(selected)
+    running = {}
+
+    def finish(stage, started, error=None):
+        # A stage that swallowed an error can return without rewriting its
+        # outputs; recording it as run would leave stale outputs up to date
+        missing = [path for path in stage.outputs if not os.path.exists(path)]
+        stale = [path for path in stage.outputs if path not in missing and not _modified_since(path, started)]
+        if error is not None or missing or stale:
+            problem = error or ('missing ' + ', '.join(missing) if missing else 'did not rewrite ' + ', '.join(stale))
+            print(f"Stage {stage.name} failed: {problem}")
+            outcome[stage.name] = 'failed'
+            state['stages'].pop(stage.name, None)
+        else:
+            state['stages'][stage.name] = {
+                'inputs': fingerprinter.fingerprints(stage.inputs),
+                'outputs': fingerprinter.fingerprints(stage.outputs),
+                'params': stage.params or {}
+            }
+            outcome[stage.name] = 'ran'
+        state['files'] = fingerprinter.cache
+        save_state(state, state_path)
+
+    def start_ready(executor):
+        """
+        Start (or settle) every pending stage whose dependencies have finished.
+        """
+        for stage in list(pending):
+            if not all(dep in outcome or dep not in names for dep in stage.deps):
+                continue
+            pending.remove(stage)
+            if any(outcome.get(dep) == 'failed' for dep in stage.deps):
+                print(f"Skipping {stage.name}: an upstream stage failed")
+                outcome[stage.name] = 'failed'
+                continue
+
+            # Upstream outputs have already been rewritten at this point, so
+            # comparing input fingerprints tells whether they actually changed
+            reason = 'forced' if stage.name in forced else stale_reason(stage, state, fingerprinter)
+            if reason is None:
+                print(f"{stage.name}: up to date")
+                outcome[stage.name] = 'up to date'
+                continue
+
+            print(f"Running {stage.name} ({reason})")
+            started = time.time()
+            if executor is None:
+                try:
+                    with measure(f"stage:{stage.name}", 'stage'):
+                        stage.func(**(stage.params or {}))
+                    finish(stage, started)
+                except Exception as e:
+                    finish(stage, started, e)
+            else:
+                future = executor.submit(run_profiled, stage.func, f"stage:{stage.name}", 'stage',
+                                         **(stage.params or {}))
+                running[future] = (stage, started)
+
+    if max_workers == 1:
+        # Settling a stage can make others ready, so repeat until all are done
+        while pending:
+            start_ready(None)
+        return {stage.name: outcome[stage.name] for stage in selected}
+
+    with ProcessPoolExecutor(max_workers=min(len(selected), max_workers or len(selected)) or 1) as executor:
+        start_ready(executor)
+        while running or pending:
+            if not running:
+                start_ready(executor)
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, started = running.pop(future)
+                try:
+                    _, records = future.result()
+                    PROFILER.add_records(records)
+                    finish(stage, started)
+                except Exception as e:
+                    finish(stage, started, e)
+            start_ready(executor)
+
+    return {stage.name: outcome[stage.name] for stage in selected}
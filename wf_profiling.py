@@ -0,0 +1,172 @@
+import cProfile
+import csv
+import functools
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # POSIX only; peak RSS is not recorded elsewhere (e.g. on Windows)
+    resource = None
+
+REPORT_FIELDS = ['name', 'category', 'pid', 'start', 'wall_seconds', 'cpu_seconds',
+                 'rss_mb', 'peak_rss_mb', 'peak_rss_growth_mb', 'profile', 'error']
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _current_rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Profiler:
+    """
+    Collect timing, memory and optional cProfile records for pipeline work.
+
+    Each record holds wall and CPU time, resident memory at the end of the
+    section and the process peak RSS (with how much the section raised it).
+    cProfile output is captured for sections whose category is listed in
+    `cprofile_categories`, written to `profile_dir` as <name>.prof.
+    """
+
+    def __init__(self, enabled=True, cprofile_categories=(), profile_dir=os.path.join('evaluation', 'profiles')):
+        self.enabled = enabled
+        self.cprofile_categories = set(cprofile_categories)
+        self.profile_dir = profile_dir
+        self.records = []
+        self._profiling = False
+
+    def configure(self, enabled=None, cprofile_categories=None, profile_dir=None):
+        if enabled is not None:
+            self.enabled = enabled
+        if cprofile_categories is not None:
+            self.cprofile_categories = set(cprofile_categories)
+        if profile_dir is not None:
+            self.profile_dir = profile_dir
+
+    @contextmanager
+    def measure(self, name, category='stage'):
+        """
+        Time the enclosed block. Yields the record, which is filled in when
+        the block exits (also on error).
+        """
+        record = {'name': name, 'category': category, 'pid': os.getpid()}
+        if not self.enabled:
+            yield record
+            return
+
+        profile = None
+        # Only one cProfile profiler can be active at a time
+        if category in self.cprofile_categories and not self._profiling:
+            profile = cProfile.Profile()
+            self._profiling = True
+
+        peak_before = _peak_rss_mb()
+        record['start'] = time.time()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield record
+        except BaseException as e:
+            record['error'] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            if profile is not None:
+                profile.disable()
+                self._profiling = False
+                os.makedirs(self.profile_dir, exist_ok=True)
+                safe_name = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in name)
+                record['profile'] = os.path.join(self.profile_dir, f"{safe_name}.{os.getpid()}.prof")
+                profile.dump_stats(record['profile'])
+
+            record['wall_seconds'] = time.perf_counter() - wall
+            record['cpu_seconds'] = time.process_time() - cpu
+            record['rss_mb'] = _current_rss_mb()
+            record['peak_rss_mb'] = _peak_rss_mb()
+            record['peak_rss_growth_mb'] = (record['peak_rss_mb'] - peak_before
+                                            if peak_before is not None else None)
+            self.records.append(record)
+
+    def timed(self, name=None, category='function'):
+        """
+        Decorator form of measure(); defaults to the function's qualified name.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.measure(name or f"{func.__module__}.{func.__qualname__}", category):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def add_records(self, records):
+        """
+        Merge records collected in another process (e.g. a pool worker).
+        """
+        if self.enabled:
+            self.records.extend(records)
+
+    def collect(self):
+        """
+        Return and clear the records gathered so far.
+        """
+        records, self.records = self.records, []
+        return records
+
+    def write_report(self, path):
+        """
+        Write the records to `path` as JSON, or as CSV if it ends in .csv.
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        if path.endswith('.csv'):
+            with open(path, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS, extrasaction='ignore')
+                writer.writeheader()
+                writer.writerows(self.records)
+        else:
+            with open(path, 'w') as f:
+                json.dump({'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'records': self.records}, f, indent=2)
+        return path
+
+
+# Process-wide profiler used by the pipeline modules
+PROFILER = Profiler()
+
+
+def measure(name, category='stage'):
+    return PROFILER.measure(name, category)
+
+
+def timed(name=None, category='function'):
+    return PROFILER.timed(name, category)
+
+
+def run_profiled(func, name, category, *args, **kwargs):
+    """
+    Call `func` under measure() and return (result, records).
+
+    Meant to be submitted to a process pool: the worker's records travel back
+    with the result so the parent can merge them with add_records().
+    """
+    start = len(PROFILER.records)
+    with measure(name, category):
+        result = func(*args, **kwargs)
+    records = PROFILER.records[start:]
+    del PROFILER.records[start:]
+    return result, records
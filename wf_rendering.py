@@ -0,0 +1,80 @@
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import matplotlib
+import matplotlib.pyplot as plt
+
+from wf_profiling import PROFILER, measure, run_profiled
+
+# A deferred plot: a module-level plotting function and its arguments. The
+# arguments must be picklable data (arrays, names, paths), not estimators.
+PlotSpec = namedtuple('PlotSpec', ['func', 'args', 'kwargs'])
+
+
+def plot_spec(func, *args, **kwargs):
+    return PlotSpec(func, args, kwargs)
+
+
+@contextmanager
+def released_figure(**kwargs):
+    """
+    Create a figure and always close it on exit, even if plotting fails.
+    """
+    fig = plt.figure(**kwargs)
+    try:
+        yield fig
+    finally:
+        plt.close(fig)
+
+
+def _use_agg():
+    matplotlib.use('Agg', force=True)
+
+
+def _plot_name(spec):
+    return f"plot:{spec.func.__name__}"
+
+
+def render_plots(specs, max_workers=None, enabled=True):
+    """
+    Render collected plot specifications.
+
+    Plots are rendered in a process pool on the Agg backend when more than
+    one worker is available. A failing plot is reported and does not stop
+    the others. Nothing is rendered when `enabled` is False (e.g. headless scoring jobs).
+
+    Returns the number of plots rendered.
+    """
+    if not enabled or not specs:
+        return 0
+
+    max_workers = max(1, min(max_workers or os.cpu_count() or 1, len(specs)))
+    rendered = 0
+
+    if max_workers == 1:
+        # Switching backends here would close the caller's open figures, so
+        # in-process rendering keeps the current backend
+        for spec in specs:
+            try:
+                with measure(_plot_name(spec), 'plot'):
+                    spec.func(*spec.args, **spec.kwargs)
+                rendered += 1
+            except Exception as e:
+                print(f"Error rendering {spec.func.__name__}: {str(e)}")
+        return rendered
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_use_agg) as executor:
+        futures = [
+            (spec, executor.submit(run_profiled, spec.func, _plot_name(spec), 'plot', *spec.args, **spec.kwargs))
+            for spec in specs
+        ]
+        for spec, future in futures:
+            try:
+                _, records = future.result()
+                PROFILER.add_records(records)
+                rendered += 1
+            except Exception as e:
+                print(f"Error rendering {spec.func.__name__}: {str(e)}")
+    return rendered
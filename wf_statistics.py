@@ -0,0 +1,160 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from wf_dataprocessing import nan_moments
+
+QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+
+def _quantile_name(q):
+    return 'median' if q == 0.5 else f'{q:.0%}'
+
+
+def describe_columns(values, columns, quantiles=QUANTILES, block_size=64):
+    """
+    Summary statistics of every column of a 2D array, ignoring NaNs.
+
+    Columns are processed in blocks of `block_size`: each block is copied
+    to float64 once, its moments taken with nan_moments and the copy sorted
+    along the rows, after which the minimum, maximum and every quantile of
+    every column in the block are plain lookups into the sorted block
+    (quantiles interpolate linearly, as numpy's default).
+
+    Returns:
+    DataFrame indexed by column with count, nan_rate, mean, std, min, the
+    quantiles ('median' for 0.5) and max
+    """
+    n_rows = values.shape[0]
+    quantiles = np.asarray(quantiles, dtype=np.float64)
+    blocks = []
+    for start in range(0, values.shape[1], block_size):
+        block = values[:, start:start + block_size].astype(np.float64)
+        moments = nan_moments(block)
+        count = moments['count']
+        # NaNs sort to the end, so the first `count` rows of a column are its values
+        block.sort(axis=0)
+
+        last = np.maximum(count - 1, 0)
+        positions = quantiles[:, np.newaxis] * last
+        lower = np.floor(positions).astype(np.intp)
+        upper = np.minimum(lower + 1, last)
+        fraction = positions - lower
+        low_values = np.take_along_axis(block, lower, axis=0)
+        high_values = np.take_along_axis(block, upper, axis=0)
+        quantile_values = low_values + fraction * (high_values - low_values)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            std = np.where(count > 1, np.sqrt(moments['m2'] / (count - 1)), np.nan)
+        observed = count > 0
+        block_stats = {
+            'count': count,
+            'nan_rate': 1 - count / n_rows if n_rows else np.full(len(count), np.nan),
+            'mean': np.where(observed, moments['mean'], np.nan),
+            'std': std,
+            'min': np.where(observed, block[0], np.nan)
+        }
+        for q, row in zip(quantiles, quantile_values):
+            block_stats[_quantile_name(q)] = np.where(observed, row, np.nan)
+        block_stats['max'] = np.where(observed, np.take_along_axis(block, last[np.newaxis], axis=0)[0], np.nan)
+        blocks.append(block_stats)
+
+    return pd.DataFrame({name: np.concatenate([block[name] for block in blocks]) for name in blocks[0]},
+                        index=pd.Index(columns, name='feature'))
+
+
+def value_counts(values):
+    """
+    Distinct values of a 1D array and their counts from one sort.
+
+    Returns (values, counts), both ordered by value.
+    """
+    return np.unique(np.asarray(values), return_counts=True)
+
+
+def correlation_matrix(values, block_size=256):
+    """
+    Pearson correlation matrix of the columns of a 2D array, each pair over
+    the rows where both columns are observed (pairwise complete, as
+    DataFrame.corr).
+
+    The matrix is filled one (block x block) tile at a time from float64
+    copies of two column blocks, centred on their observed means. With the
+    missing entries zeroed, the pair counts, sums, sums of squares and
+    cross products of a whole tile are matrix products with the blocks'
+    observed masks, so the working set besides the result is bounded by the
+    block size. Tiles without missing values need only the cross products.
+    Constant columns get NaN correlations.
+    """
+    n_cols = values.shape[1]
+    means = []
+    constant = []
+    for start in range(0, n_cols, block_size):
+        block = values[:, start:start + block_size].astype(np.float64)
+        means.append(nan_moments(block)['mean'])
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            constant.append(~(np.nanmax(block, axis=0) > np.nanmin(block, axis=0)))
+    mean = np.concatenate(means)
+    constant = np.concatenate(constant)
+
+    def centred(start, stop):
+        block = values[:, start:stop].astype(np.float64) - mean[start:stop]
+        missing = np.isnan(block)
+        if not missing.any():
+            return block, None
+        block[missing] = 0.0
+        return block, (~missing).astype(np.float64)
+
+    matrix = np.empty((n_cols, n_cols))
+    for i_start in range(0, n_cols, block_size):
+        i_stop = min(i_start + block_size, n_cols)
+        x_i, observed_i = centred(i_start, i_stop)
+
+        for j_start in range(i_start, n_cols, block_size):
+            j_stop = min(j_start + block_size, n_cols)
+            x_j, observed_j = (x_i, observed_i) if j_start == i_start else centred(j_start, j_stop)
+
+            cross = x_i.T @ x_j
+            with np.errstate(invalid='ignore', divide='ignore'):
+                if observed_i is None and observed_j is None:
+                    norms = np.sqrt((x_i * x_i).sum(axis=0))[:, np.newaxis] * np.sqrt((x_j * x_j).sum(axis=0))
+                    tile = cross / norms
+                else:
+                    ones_i = observed_i if observed_i is not None else np.ones_like(x_i)
+                    ones_j = observed_j if observed_j is not None else np.ones_like(x_j)
+                    count = ones_i.T @ ones_j
+                    sum_i = x_i.T @ ones_j
+                    sum_j = ones_i.T @ x_j
+                    var_i = (x_i * x_i).T @ ones_j - sum_i ** 2 / count
+                    var_j = ones_i.T @ (x_j * x_j) - sum_j ** 2 / count
+                    tile = (cross - sum_i * sum_j / count) / np.sqrt(var_i * var_j)
+            matrix[i_start:i_stop, j_start:j_stop] = tile
+            matrix[j_start:j_stop, i_start:i_stop] = tile.T
+
+    matrix[constant, :] = np.nan
+    matrix[:, constant] = np.nan
+    return matrix
+
+
+def top_correlated_pairs(matrix, columns, k=20):
+    """
+    The `k` column pairs with the largest absolute correlation.
+
+    Returns:
+    DataFrame with feature_a, feature_b and correlation, strongest first
+    """
+    rows, cols = np.triu_indices(len(matrix), k=1)
+    strength = np.abs(matrix[rows, cols])
+    strength[np.isnan(strength)] = -1.0
+    k = min(k, len(strength))
+    top = np.argpartition(-strength, k - 1)[:k] if k else np.array([], dtype=np.intp)
+    top = top[np.argsort(-strength[top], kind='stable')]
+    top = top[strength[top] >= 0]
+    columns = np.asarray(columns)
+    return pd.DataFrame({
+        'feature_a': columns[rows[top]],
+        'feature_b': columns[cols[top]],
+        'correlation': matrix[rows[top], cols[top]]
+    })
@@ -0,0 +1,185 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+SECOM_OUTPUT = os.path.join('data_processed', 'serialized', 'secom_output')
+IMPUTATION_STATS = os.path.join('data_processed', 'imputation_stats.npz')
+FEATURE_MANIFEST = os.path.join('data_processed', 'feature_manifest.json')
+SCHEMA_FILE = 'schema.json'
+
+# Wafer timestamp column carried alongside the label; it is not a feature
+TIME_COLUMN = 'timestamp'
+
+# Feature dtypes the store can hold; float32 halves memory and I/O
+FEATURE_DTYPES = ('float64', 'float32')
+
+
+def _build_schema(dtypes, n_rows):
+    """
+    Group columns into one block per dtype. Each block is a column-major
+    (Fortran ordered) 2D .npy file, so a single column is one contiguous
+    range on disk.
+    """
+    blocks = {}
+    columns = []
+    for name, dtype in dtypes.items():
+        dtype = np.dtype(dtype).name
+        file_stem = ''.join(c if c.isalnum() else '_' for c in dtype).strip('_')
+        block = blocks.setdefault(dtype, {'file': f'{file_stem}.npy', 'width': 0})
+        columns.append({'name': name, 'block': dtype, 'index': block['width']})
+        block['width'] += 1
+
+    return {'rows': int(n_rows), 'columns': columns, 'blocks': blocks}
+
+
+class ColumnarWriter:
+    """
+    Incrementally write row chunks into a columnar store.
+
+    The number of rows and the column dtypes must be known up front; the
+    block files are preallocated as memory maps and filled chunk by chunk.
+    """
+
+    def __init__(self, path, dtypes, n_rows):
+        self.path = path
+        self.schema = _build_schema(dtypes, n_rows)
+        self.row = 0
+
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+
+        self._blocks = {
+            dtype: np.lib.format.open_memmap(os.path.join(path, block['file']),
+                                             mode='w+',
+                                             dtype=dtype,
+                                             shape=(n_rows, block['width']),
+                                             fortran_order=True)
+            for dtype, block in self.schema['blocks'].items()
+        }
+
+    def write(self, frame):
+        stop = self.row + len(frame)
+        if stop > self.schema['rows']:
+            raise ValueError(f"Writing {stop} rows into a store sized for {self.schema['rows']}")
+
+        for column in self.schema['columns']:
+            self._blocks[column['block']][self.row:stop, column['index']] = frame[column['name']].to_numpy()
+        self.row = stop
+
+    def close(self):
+        for block in self._blocks.values():
+            block.flush()
+        self._blocks = {}
+
+        if self.row != self.schema['rows']:
+            raise ValueError(f"Store expected {self.schema['rows']} rows, got {self.row}")
+
+        with open(os.path.join(self.path, SCHEMA_FILE), 'w') as schema_file:
+            json.dump(self.schema, schema_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._blocks = {}
+
+
+def write_columnar(df, path=SECOM_OUTPUT):
+    """
+    Write a DataFrame to a columnar store at `path`.
+    """
+    with ColumnarWriter(path, df.dtypes.to_dict(), len(df)) as writer:
+        writer.write(df)
+    return path
+
+
+def read_schema(path=SECOM_OUTPUT):
+    with open(os.path.join(path, SCHEMA_FILE)) as schema_file:
+        return json.load(schema_file)
+
+
+def load_columnar(path=SECOM_OUTPUT, columns=None):
+    """
+    Load a DataFrame from a columnar store, reading only `columns`.
+
+    Block files are memory mapped, so only the pages backing the requested
+    columns are read from disk. When every column of a block is requested
+    the block is wrapped without copying.
+    """
+    schema = read_schema(path)
+    by_name = {column['name']: column for column in schema['columns']}
+
+    if columns is None:
+        columns = [column['name'] for column in schema['columns']]
+    missing = [name for name in columns if name not in by_name]
+    if missing:
+        raise KeyError(f"Columns not in store: {missing}")
+
+    wanted = {}
+    for name in columns:
+        wanted.setdefault(by_name[name]['block'], []).append(name)
+
+    frames = []
+    for dtype, names in wanted.items():
+        block_info = schema['blocks'][dtype]
+        block = np.load(os.path.join(path, block_info['file']), mmap_mode='r')
+        indices = [by_name[name]['index'] for name in names]
+        if indices == list(range(block_info['width'])):
+            values = block
+        else:
+            values = np.asarray(block[:, indices])
+        frames.append(pd.DataFrame(values, columns=names, copy=False))
+
+    df = frames[0] if len(frames) == 1 else pd.concat(frames, axis=1, copy=False)
+    if list(df.columns) != list(columns):
+        df = df[columns]
+    return df
+
+
+def store_feature_dtype(path=SECOM_OUTPUT):
+    """
+    The floating-point dtype the features of a store were written with,
+    or None if it holds no floating-point block.
+    """
+    floating = [np.dtype(dtype) for dtype in read_schema(path)['blocks']
+                if np.issubdtype(np.dtype(dtype), np.floating)]
+    if len(floating) > 1:
+        raise ValueError(f"Store {path} mixes feature dtypes: {', '.join(d.name for d in floating)}")
+    return floating[0] if floating else None
+
+
+def audit_dtype(data, dtype, stage):
+    """
+    Check that every floating-point column of `data` (a DataFrame, Series or
+    array) still has `dtype`, so no stage silently upcasts a float32 store.
+
+    Raises TypeError naming the stage and the offending columns; returns
+    `data` unchanged otherwise.
+    """
+    dtype = np.dtype(dtype)
+    if isinstance(data, pd.DataFrame):
+        dtypes = data.dtypes
+    else:
+        dtypes = pd.Series([data.dtype], index=[getattr(data, 'name', None)])
+
+    wrong = [(str(name), column_dtype.name) for name, column_dtype in dtypes.items()
+             if np.issubdtype(column_dtype, np.floating) and column_dtype != dtype]
+    if wrong:
+        shown = ', '.join(f'{name} ({found})' for name, found in wrong[:5])
+        more = f' and {len(wrong) - 5} more' if len(wrong) > 5 else ''
+        raise TypeError(f"{stage}: expected {dtype.name} features, got {shown}{more}")
+    return data
+
+
+def load_secom(columns=None):
+    """
+    Shared loader for the munged SECOM data used by every pipeline stage.
+    """
+    return load_columnar(SECOM_OUTPUT, columns)
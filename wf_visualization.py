@@ -1,76 +1,44 @@
 import os
-import pickle
-from dbm import error
 from itertools import combinations
 
 import matplotlib.pyplot as plt
-import numpy as np
 import pandas as pd
 
+from wf_dataprocessing import load_imputation_stats, missing_fraction
+from wf_profiling import measure
+from wf_rendering import released_figure
+from wf_statistics import correlation_matrix, describe_columns, top_correlated_pairs, value_counts
+from wf_storage import IMPUTATION_STATS, load_secom, read_schema
 
-def visualize_data():
+
+def visualize_data(render=True):
     pd.options.display.float_format = "{:,.4f}".format
 
-    def find_summary_stats(data):
-        def compute_quantitative(df, col):
-            mn = df[col].min()
-            mx = df[col].max()
-            md = df[col].median()
-            res = '\nFeature: `' + str(col) + '` - Summary Statistics\n'
-            res += 'Min: ' + str(mn) + '\n'
-            res += 'Max: ' + str(mx) + '\n'
-            res += 'Median: ' + str(md) + '\n'
-            return res
-
-        def compute_qualitative(df, col):
-            cats = df[col].unique()
-            num = len(cats)
-            mf = []
-            mx = None
-            lf = []
-            ls = None
-
-            if num == 0:
-                raise error
-
-            for cat in cats:
-                cur_df = df[df[col] == cat]
-                cur_len = len(cur_df)
-
-                if mx is None:
-                    mf = [cat]
-                    mx = cur_len
-                elif cur_len == mx:
-                    mf.append(cat)
-                elif cur_len > mx:
-                    mf = [cat]
-                    mx = cur_len
-
-                if ls is None:
-                    lf = [cat]
-                    ls = cur_len
-                elif cur_len == ls:
-                    lf.append(cat)
-                elif cur_len < ls:
-                    lf = [cat]
-                    ls = cur_len
-
-            res = '\nFeature: `' + str(col) + '` - Summary Statistics\n'
-            res += 'Number of Categories: ' + str(num) + '\n'
-            res += 'Most Frequent: ' + ', '.join(str(x) for x in mf) + '\n'
-            res += 'Least Frequent: ' + ', '.join(str(x) for x in lf) + '\n'
-            return res
+    def find_summary_stats(labels, features):
+        categories, counts = value_counts(labels)
+        if len(categories) == 0:
+            raise ValueError('No wafers to summarize')
 
         line = '\n' + ('-' * 40) + '\n'
 
         result = line
         result += 'Qualitative Statistics:\n'
-        result += compute_qualitative(data, 'pass')
+        result += '\nFeature: `pass` - Summary Statistics\n'
+        result += 'Number of Categories: ' + str(len(categories)) + '\n'
+        result += 'Most Frequent: ' + ', '.join(str(x) for x in categories[counts == counts.max()]) + '\n'
+        result += 'Least Frequent: ' + ', '.join(str(x) for x in categories[counts == counts.min()]) + '\n'
         result += line
 
-        result += 'Quantitative Statistics:\n'
-        for i in range(4):
-            result += compute_quantitative(data, 'feature_' + str(i))
+        # One row per feature; the full table is also written as CSV
+        stats = describe_columns(features.to_numpy(), features.columns)
+        if os.path.exists(IMPUTATION_STATS):
+            missing = missing_fraction(load_imputation_stats())
+            if missing is not None and len(missing) == features.shape[1]:
+                stats.insert(2, 'missing_before_imputation', missing)
+        stats.to_csv(data_path + 'feature_statistics.csv')
+
+        result += 'Quantitative Statistics:\n\n'
+        result += stats.to_string() + '\n'
 
         output = (
                 data_path
@@ -82,50 +50,52 @@ def visualize_data():
             except Exception as err:
                 print(err)
                 pass
+        return dict(zip(categories, counts))
 
-    def find_pairwise_correlations(data):
+    def find_pairwise_correlations(features, k=20):
         output = (
                 data_path
                 + 'correlations.txt'
         )
 
-        q_df = data[[col for col in data.columns if col.startswith('feature_')][:4]]
-        matrix = q_df.corr()
-        half = matrix.where(np.tril(np.ones(matrix.shape)).astype(bool), '')
+        matrix = correlation_matrix(features.to_numpy())
+        pairs = top_correlated_pairs(matrix, features.columns, k)
+        result = 'Top ' + str(len(pairs)) + ' correlated feature pairs of ' + str(features.shape[1]) + ' features\n\n'
+        result += pairs.to_string(index=False) + '\n'
         with open(output, 'wb') as output_file:
             try:
-                output_file.write(str(half).encode('utf-8'))
+                output_file.write(result.encode('utf-8'))
             except Exception as err:
                 print(err)
                 pass
 
-    def plot_data(data):
+    def plot_data(data, class_counts):
         def plot_scatter(x, y, xlabel, ylabel):
             title = xlabel + ' vs ' + ylabel
-            plt.figure()
-            plt.title(title)
-            plt.xlabel(xlabel)
-            plt.ylabel(ylabel)
-            plt.grid(True)
-            plt.scatter(x, y, s=4)
-            plt.savefig(
-                visual_path
-                + title
-                + '.png'
-            )
+            with released_figure():
+                plt.title(title)
+                plt.xlabel(xlabel)
+                plt.ylabel(ylabel)
+                plt.grid(True)
+                plt.scatter(x, y, s=4)
+                plt.savefig(
+                    visual_path
+                    + title
+                    + '.png'
+                )
 
         def plot_histogram():
             title = 'Number of wafers Passed vs Failed'
-            plt.figure()
-            plt.ylabel('Number of wafers')
-            plt.title(title)
-            dat = [len(data[data['pass'] == -1]), len(data[data['pass'] == 1])]
-            plt.bar(['-1 (Pass)', '1 (Fail)'], dat)
-            plt.savefig(
-                visual_path
-                + title
-                + '.png'
-            )
+            with released_figure():
+                plt.ylabel('Number of wafers')
+                plt.title(title)
+                dat = [class_counts.get(-1, 0), class_counts.get(1, 0)]
+                plt.bar(['-1 (Pass)', '1 (Fail)'], dat)
+                plt.savefig(
+                    visual_path
+                    + title
+                    + '.png'
+                )
 
         features = [col for col in data.columns if col.startswith('feature_')][:4]
         s_plots = combinations(features, 2)
@@ -135,14 +105,6 @@ def visualize_data():
         plot_histogram()
 
     path_sep = os.path.sep
-    pickled_data = (
-            'data_processed'
-            + path_sep
-            + 'serialized'
-            + path_sep
-            + 'secom_output.pickle'
-    )
-
     data_path = (
             'data_processed'
             + path_sep
@@ -153,15 +115,22 @@ def visualize_data():
             + path_sep
     )
 
-    with open(pickled_data, 'rb') as f:
-        try:
-            data_f = pd.DataFrame(pickle.load(f))
-            find_summary_stats(data_f)
+    try:
+        # Every feature is summarized; the first four are plotted. The
+        # feature block is memory mapped and read one column block at a time.
+        features = [column['name'] for column in read_schema()['columns'] if column['name'].startswith('feature_')]
+        with measure('visualize:load', 'io'):
+            labels = load_secom(['pass'])['pass'].to_numpy()
+            data_f = load_secom(features)
+        with measure('visualize:statistics', 'statistics'):
+            class_counts = find_summary_stats(labels, data_f)
             find_pairwise_correlations(data_f)
-            plot_data(data_f)
-        except Exception as err:
-            print(err)
-            pass
+        if render:
+            with measure('plot:visualize_data', 'plot'):
+                plot_data(data_f, class_counts)
+    except Exception as err:
+        print(err)
+        raise
 
 
 if __name__ == '__main__':